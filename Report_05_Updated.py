@@ -14,10 +14,17 @@ the cell and its neighbors.
 """
 
 
+import struct
+import zlib
+
 import numpy as np
 import matplotlib.pyplot as plt
 
 
+CELL_COLORS = np.array([[1, 0, 0], [0, 1, 1], [0.5, 0, 1], [1, 1, 0]], 
+                       dtype = float) # red, cyan, purple, yellow
+
+
 def cell_auto():
     
     """
@@ -45,8 +52,7 @@ def cell_auto():
     nGen = 25 # number of generations to apply transition rule to
     nCells = 25 # number of cells
     
-    colors = np.array([[1, 0, 0], [0, 1, 1], [0.5, 0, 1], [1, 1, 0]], 
-                      dtype = float) # red, cyan, purple, yellow
+    colors = CELL_COLORS
     
     plt.figure(figsize = (10, 10))
     
@@ -74,4 +80,114 @@ def cell_auto():
         plt.title(str(j), fontsize = 16)
         plt.xlabel(str(rule), fontsize = 16)
         plt.xticks([])
-        plt.yticks([])
\ No newline at end of file
+        plt.yticks([])
+
+
+def _png_chunk(file, chunkType, data):
+    
+    """
+    Writes a single length-prefixed, CRC-terminated PNG chunk to file.
+    """
+    
+    file.write(struct.pack('>I', len(data)))
+    file.write(chunkType)
+    file.write(data)
+    file.write(struct.pack('>I', zlib.crc32(chunkType + data) & 0xffffffff))
+
+
+def stream_cell_auto(filename, nGen, nCells, rule = None, colors = CELL_COLORS,
+                     chunkSize = 1 << 16):
+    
+    """
+    Streams the spacetime diagram of a cellular automaton to disk one
+    generation at a time, for automata too large to hold in memory. Uses the
+    same four cell states, periodic edges and sum-of-neighbors transition rule
+    as cell_auto.
+    
+    Only the current generation is kept in memory. Each generation is written
+    as one row of 8-bit palette indices, so the image costs 1 byte per cell on
+    disk and the float RGB expansion is never built.
+    
+    If filename ends in '.png', an indexed-color PNG is written with the
+    palette embedded and the rows compressed as they are produced. Otherwise
+    the rows are written to a raw uint8 file of shape (nGen, nCells) through a
+    memory map, which can be reopened with
+    np.memmap(filename, dtype = np.uint8, mode = 'r', shape = (nGen, nCells)).
+    
+    Parameters:
+        filename (str): the file to write the spacetime diagram to
+        
+        nGen (int): number of generations to apply transition rule to
+        
+        nCells (int): number of cells
+        
+        rule (array[int]): the 10 element transition rule. A random rule is
+        used if none is given
+        
+        colors (array[float]): the RGB color of each cell state, from 0 to 1
+        
+        chunkSize (int): number of bytes to buffer before writing a compressed
+        PNG chunk
+        
+    Returns:
+        rule (array[int]): the transition rule that was applied
+        
+        palette (array[int]): the uint8 RGB color of each palette index
+    """
+    
+    if rule is None:
+        rule = np.random.randint(4, size = 10)
+    rule = np.asarray(rule, dtype = np.uint8)
+    palette = np.round(np.asarray(colors)*255).astype(np.uint8)
+    
+    cells = np.random.randint(4, size = nCells).astype(np.uint8)
+    sumCells = np.empty(nCells, dtype = np.uint8)
+    
+    def advance(cells):
+        np.add(cells, np.roll(cells, -1), out = sumCells)
+        np.add(sumCells, np.roll(cells, 1), out = sumCells)
+        
+        return rule[sumCells]
+    
+    if filename.lower().endswith('.png'):
+        with open(filename, 'wb') as file:
+            file.write(b'\x89PNG\r\n\x1a\n')
+            _png_chunk(file, b'IHDR', struct.pack('>IIBBBBB', nCells, nGen, 
+                                                  8, 3, 0, 0, 0))
+            _png_chunk(file, b'PLTE', palette.tobytes())
+            
+            compressor = zlib.compressobj()
+            pending = []
+            nPending = 0
+            
+            for i in range(nGen):
+                if i > 0:
+                    cells = advance(cells)
+                
+                # each scanline starts with a filter type byte, 0 = no filter
+                data = compressor.compress(b'\x00' + cells.tobytes())
+                if data:
+                    pending.append(data)
+                    nPending += len(data)
+                
+                if nPending >= chunkSize:
+                    _png_chunk(file, b'IDAT', b''.join(pending))
+                    pending = []
+                    nPending = 0
+            
+            pending.append(compressor.flush())
+            _png_chunk(file, b'IDAT', b''.join(pending))
+            _png_chunk(file, b'IEND', b'')
+    else:
+        image = np.memmap(filename, dtype = np.uint8, mode = 'w+', 
+                          shape = (nGen, nCells))
+        
+        for i in range(nGen):
+            if i > 0:
+                cells = advance(cells)
+            image[i] = cells
+        
+        image.flush()
+        del image
+    
+    return rule, palette
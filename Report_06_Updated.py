@@ -14,16 +14,129 @@ There are 3 main forces that act on the pendulum system:
 """
 
 
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import animation
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+MAGNETS = np.array([[1, 0], [-0.5, np.sqrt(3)/2], [-0.5, -np.sqrt(3)/2]])
+
+
+def force_kernel(G, R, d, magnets = MAGNETS):
+    
+    """
+    Builds a vectorized version of dP_dt for a fixed set of parameters.
+    
+    The magnet positions are held as precomputed column arrays so the 
+    contributions of every magnet are found in one broadcast expression, and 
+    r**2 is computed once and reused for both the 1/r**5 and the 5*d**2/r**2 
+    terms. The scratch arrays are allocated on the first call and reused for 
+    as long as the size of the state stays the same.
+    
+    G, R and d may also be arrays of shape P.shape[1:], giving separate 
+    parameters for every state in P.
+    
+    Parameters:
+        G (float or array[float]): the force due to gravity
+        
+        R (float or array[float]): the frictional forces
+        
+        d (float or array[float]): the distance in the z direction (vertical 
+        distance)
+        
+        magnets (array[float]): an (nMags, 2) array containing the x and y
+        location of each magnet
+        
+    Returns:
+        kernel (function): kernel(P, out = None) returns dP/dt for a state P 
+        of shape (4, ...), where the first axis is ordered x positon, 
+        y postion, x velocity, y velocity. The result is written into out, 
+        which must be a contiguous array of the same shape as P and not P 
+        itself, if it is given
+    """
+    
+    magnets = np.asarray(magnets, dtype = float)
+    nMags = len(magnets)
+    mags = magnets.T.reshape(2, nMags, 1) # x and y locations as columns
+    perState = np.ndim(G) > 0 or np.ndim(R) > 0
+    G, R, d2 = [np.reshape(v, -1) if np.ndim(v) else v for v in (G, R, d**2)]
+    
+    # the velocity, gravity and friction terms are linear in P, so for a 
+    # single set of parameters they are one matrix product
+    linear = None if perState else np.array([[0, 0, 1, 0], [0, 0, 0, 1], 
+                                             [-G, 0, -R, 0], [0, -G, 0, -R]])
+    scratch = {}
+    
+    def kernel(P, out = None):
+        
+        """
+        Calculates dP/dt for every state in P at once.
+        """
+        
+        dtype = P.dtype if P.dtype.kind == 'f' else float
+        if out is None:
+            out = np.empty(P.shape, dtype = dtype)
+            
+        P = P.reshape(4, 1, -1)
+        dP = out.reshape(4, -1)
+        n = dP.shape[1]
+        
+        if scratch.get('key') != (n, dtype):
+            scratch.clear()
+            scratch['key'] = (n, dtype)
+            scratch['arrays'] = (np.empty((2, nMags, n), dtype = dtype),
+                                 np.empty((2, nMags, n), dtype = dtype),
+                                 np.empty((nMags, n), dtype = dtype),
+                                 np.empty((2, n), dtype = dtype),
+                                 mags.astype(dtype))
+            scratch['linear'] = None if perState else linear.astype(dtype)
+        diffs, sq, r2, forces, M = scratch['arrays']
+        A = scratch['linear']
+        
+        np.subtract(P[:2], M, out = diffs) # x and y distances to each magnet
+        np.multiply(diffs, diffs, out = sq)
+        np.add(sq[0], sq[1], out = r2)
+        r2 += d2
+        
+        w = sq[0] # reuse the squared distances as scratch space
+        np.power(r2, -2.5, out = w) # 1/r**5
+        np.divide(-5*d2, r2, out = r2)
+        r2 += 1 # 1 - 5*d**2/r**2
+        w *= r2
+        diffs *= w
+        
+        if A is not None:
+            np.dot(A, P[:,0], out = dP)
+            np.sum(diffs, axis = 1, out = forces)
+            dP[2:] += forces
+        else:
+            np.sum(diffs, axis = 1, out = dP[2:])
+            np.multiply(P[:2,0], G, out = forces)
+            dP[2:] -= forces
+            np.multiply(P[2:,0], R, out = forces)
+            dP[2:] -= forces
+            dP[:2] = P[2:,0]
+        
+        return out
+    
+    return kernel
 
 
 def dP_dt(P, G, R, d):
     
     """
     Calculate the values in the governing differential equation for the 
-    pendulum system.
+    pendulum system. For repeated calls with the same parameters, use the 
+    kernel returned by force_kernel instead.
     
     Parameters:
         P (array[float]): the inital state of the system. An array of x and y 
@@ -42,27 +155,492 @@ def dP_dt(P, G, R, d):
         x velocity, y velocity
     """
     
+    return force_kernel(G, R, d)(np.asarray(P))
+
+
+def pendulum_energy(P, G, d, magnets = MAGNETS):
+    
+    """
+    Calculates the total energy of the pendulum: kinetic energy, plus the 
+    potential energy of gravity, G*(x**2 + y**2)/2, plus the magnetic 
+    potential 1/(3*r**3) - d**2/r**5 of each magnet, whose gradient is the 
+    magnetic force in dP_dt. Without friction the energy is conserved, and 
+    friction removes energy at the rate R*(vx**2 + vy**2).
+    
+    Parameters:
+        P (array[float]): states of the system, of shape (4, ...)
+        
+        G (float): the force due to gravity
+        
+        d (float): the distance in the z direction (vertical distance)
+        
+        magnets (array[float]): an (nMags, 2) array containing the x and y
+        location of each magnet
+        
+    Returns:
+        energy (array[float]): the total energy of each state, of shape 
+        P.shape[1:]
+    """
+    
     x, y, vx, vy = P
+    mags = np.asarray(magnets, dtype = float).T.reshape((2, -1) + (1,)*x.ndim)
+    
+    r2 = (x - mags[0])**2 + (y - mags[1])**2 + d**2
+    magnetic = np.sum(r2**-1.5/3 - d**2*r2**-2.5, axis = 0)
+    
+    return (vx**2 + vy**2)/2 + G*(x**2 + y**2)/2 + magnetic
+
+
+def _start_stats(stats):
+    
+    """
+    Resets the counters of an instrumentation dictionary. See calculate_path.
+    """
+    
+    stats.update({'forceEvals': 0, 'acceptedSteps': 0, 'rejectedSteps': 0, 
+                  'maxErrorEstimate': 0., 'wallTime': {'setup': 0., 
+                                                       'integrate': 0., 
+                                                       'energy': 0.}})
+
+
+def _counted(kernel, stats):
+    
+    """
+    Wraps a kernel so that every call is counted in stats['forceEvals'].
+    """
+    
+    def counted(P, out = None):
+        stats['forceEvals'] += 1
+        
+        return kernel(P, out = out)
+    
+    return counted
+
+
+def _step_error(method, h, k):
+    
+    """
+    Estimates the local error of the step just taken by a fixed step method,
+    using the scratch arrays the step left behind. For the improved Euler
+    method this is the difference from an Euler step, h*(f2 - f1)/2, which 
+    heun_step leaves as h*f2 - h*(f1 + f2)/2. Other methods have no estimate.
+    """
+    
+    if method == 'heun':
+        return np.abs(h*k[1] - k[0]).max()
+    
+    return np.nan
+
+
+def heun_step(kernel, P, h, k):
+    
+    """
+    Advances the state P by one step of the improved Euler (Heun) method.
+    
+    Parameters:
+        kernel (function): the dP/dt function returned by force_kernel
+        
+        P (array[float]): the current state of the system, updated in place
+        
+        h (float): the step size
+        
+        k (array[float]): scratch space for the slopes and the intermediate 
+        state, of shape (3,) + P.shape
+        
+    Returns:
+        P (array[float]): the state of the system after one step
+    """
+    
+    f1, f2, stage = k
+    
+    kernel(P, out = f1)
+    np.multiply(f1, h, out = stage)
+    stage += P
+    kernel(stage, out = f2)
+    
+    f1 += f2
+    f1 *= h/2
+    P += f1
+    
+    return P
+
+
+def rk4_step(kernel, P, h, k):
+    
+    """
+    Advances the state P by one step of the classical fourth order 
+    Runge-Kutta method.
+    
+    Parameters:
+        kernel (function): the dP/dt function returned by force_kernel
+        
+        P (array[float]): the current state of the system, updated in place
+        
+        h (float): the step size
+        
+        k (array[float]): scratch space for the slopes and the intermediate 
+        state, of shape (5,) + P.shape
+        
+    Returns:
+        P (array[float]): the state of the system after one step
+    """
+    
+    k1, k2, k3, k4, stage = k
+    
+    kernel(P, out = k1)
+    for kIn, kOut, frac in ((k1, k2, h/2), (k2, k3, h/2), (k3, k4, h)):
+        np.multiply(kIn, frac, out = stage)
+        stage += P
+        kernel(stage, out = kOut)
+    
+    k2 += k3
+    k2 *= 2
+    k1 += k2
+    k1 += k4
+    k1 *= h/6
+    P += k1
+    
+    return P
+
+
+# fixed step methods and the number of scratch arrays each one needs. Every 
+# step works in place in the scratch arrays, so nothing is allocated per step.
+INTEGRATORS = {'heun': (heun_step, 3), 'rk4': (rk4_step, 5)}
+
+
+# Dormand-Prince 5(4) coefficients. The last row of DOPRI_A is the fifth order
+# solution, DOPRI_E is the difference between the fifth and fourth order
+# weights and DOPRI_D gives the fourth order dense output.
+DOPRI_C = np.array([0, 1/5, 3/10, 4/5, 8/9, 1, 1])
+DOPRI_A = [[],
+           [1/5],
+           [3/40, 9/40],
+           [44/45, -56/15, 32/9],
+           [19372/6561, -25360/2187, 64448/6561, -212/729],
+           [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+           [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]]
+DOPRI_E = np.array([71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, 
+                    -1/40])
+DOPRI_D = np.array([-12715105075/11282082432, 0, 87487479700/32700410799, 
+                    -10690763975/1880347072, 701980252875/199316789632, 
+                    -1453857185/822651844, 69997945/29380423])
+
+
+def dopri_chunks(kernel, P, tEval, h, rtol = 1e-6, atol = 1e-9, 
+                 chunkSize = None, stats = None):
+    
+    """
+    Integrates with the adaptive Dormand-Prince 5(4) method and evaluates the 
+    solution at the requested times by dense output interpolation, so the 
+    step size is chosen by the error control rather than by the output 
+    spacing.
+    
+    The step is accepted when the scaled error estimate of every trajectory in
+    P is at most 1, so a grid of states shares one step size.
+    
+    Parameters:
+        kernel (function): the dP/dt function returned by force_kernel
+        
+        P (array[float]): the inital state of the system at t = 0, of shape 
+        (4, ...)
+        
+        tEval (array[float]): increasing times, starting at 0 or later, to 
+        record the state at
+        
+        h (float): the initial step size
+        
+        rtol (float): the relative error tolerance per step
+        
+        atol (float): the absolute error tolerance per step
+        
+        chunkSize (int): number of times in tEval to return at once, defaults
+        to all of them
+        
+        stats (dict): if given, the number of accepted and rejected steps and
+        the largest local error estimate are added to it, as in 
+        calculate_path
+        
+    Yields:
+        out (array[float]): the state at the next chunkSize times in tEval, of
+        shape (chunkSize,) + P.shape. The last chunk may be shorter
+        
+    Raises:
+        FloatingPointError: if the error estimate stops being finite, or the 
+        step size falls below ten times the float spacing at t, since the 
+        step would then shrink forever without reaching tEval
+    """
+    
+    tEval = np.asarray(tEval, dtype = float)
+    P = np.array(P, dtype = float)
+    k = np.empty((7,) + P.shape)
+    nEval = len(tEval)
+    chunkSize = chunkSize or max(nEval, 1)
+    
+    out = np.empty((min(chunkSize, nEval),) + P.shape)
+    filled = 0 # rows of out filled so far
     
-    xLoc = [1, -0.5, -0.5] # x location of the magnets
-    yLoc = [0, np.sqrt(3)/2, -np.sqrt(3)/2] # y location of the magnets
+    t = 0.
+    tEnd = tEval[-1] if nEval else 0.
+    j = 0 # index of the next time in tEval to record
+    kernel(P, out = k[0])
     
-    ax = -G*x - R*vx
-    ay = -G*y - R*vy
+    while j < nEval:
+        jNew = np.searchsorted(tEval, t, side = 'right')
+        
+        if jNew == j:
+            if h < 10*np.spacing(t):
+                raise FloatingPointError('step size fell below {:.3g} at '
+                                         't = {:.6g}'.format(h, t))
+            
+            h = min(h, tEnd - t)
+            
+            for i in range(1, 7):
+                stage = P + h*np.tensordot(DOPRI_A[i], k[:i], axes = 1)
+                kernel(stage, out = k[i])
+            
+            Pnew = stage # the last stage is the fifth order solution
+            scale = atol + rtol*np.maximum(np.abs(P), np.abs(Pnew))
+            localErr = h*np.tensordot(DOPRI_E, k, axes = 1)
+            err = localErr/scale
+            err = np.sqrt(np.mean((err**2).reshape(4, -1), axis = 0)).max()
+            
+            if not np.isfinite(err):
+                raise FloatingPointError('non-finite error estimate at '
+                                         't = {:.6g}'.format(t))
+            
+            if stats is not None:
+                if err <= 1:
+                    stats['acceptedSteps'] += 1
+                    stats['maxErrorEstimate'] = max(stats['maxErrorEstimate'],
+                                                    np.abs(localErr).max())
+                else:
+                    stats['rejectedSteps'] += 1
+            
+            if err <= 1:
+                tNew = t + h
+                jNew = np.searchsorted(tEval, tNew, side = 'right')
+                
+                if jNew > j:
+                    theta = (tEval[j:jNew] - t)/h
+                    theta = theta.reshape((-1,) + (1,)*P.ndim)
+                    diff = Pnew - P
+                    bspl = h*k[0] - diff
+                    r4 = diff - h*k[6] - bspl
+                    r5 = h*np.tensordot(DOPRI_D, k, axes = 1)
+                    values = P + theta*(diff + (1 - theta)*(bspl + theta*(r4 
+                                        + (1 - theta)*r5)))
+                
+                t = tNew
+                P = Pnew
+                k[0] = k[6] # first same as last
+            
+            factor = 5 if err == 0 else 0.9*err**(-1/5)
+            if err <= 1:
+                h *= min(5, max(0.2, factor))
+            else:
+                h *= min(1, max(0.2, factor))
+        else:
+            values = np.broadcast_to(P, (jNew - j,) + P.shape) # times <= 0
+        
+        # copy the new values into the output, a chunk at a time
+        while jNew > j:
+            nCopy = min(jNew - j, len(out) - filled)
+            out[filled:filled + nCopy] = values[:nCopy]
+            values = values[nCopy:]
+            filled += nCopy
+            j += nCopy
+            
+            if filled == len(out):
+                yield out
+                out = np.empty((min(chunkSize, nEval - j),) + P.shape)
+                filled = 0
+
+
+def dopri_dense(kernel, P, tEval, h, rtol = 1e-6, atol = 1e-9, stats = None):
+    
+    """
+    Same as dopri_chunks, but returns the states at every time in tEval as 
+    one array of shape (len(tEval),) + P.shape.
+    """
+    
+    return next(dopri_chunks(kernel, P, tEval, h, rtol, atol, stats = stats))
+
+
+def path_chunks(tMax, h, P, G, R, d, magnets = MAGNETS, method = 'heun', 
+                rtol = 1e-6, atol = 1e-9, chunkSize = 10000, decimate = 1, 
+                stats = None):
+    
+    """
+    Finds the same path as calculate_path, but returns it a block at a time so
+    that paths of any length can be computed in bounded memory.
+    
+    Parameters:
+        See calculate_path for the other parameters
+        
+        chunkSize (int): number of rows of the path in each block
+        
+        decimate (int): only every decimate-th step of the path is kept
+        
+        stats (dict): if given, it is filled with counters for the run as 
+        described in calculate_path. The energy is sampled at the start and 
+        at the end of every block, so stats stays small however long the 
+        path is
+        
+    Yields:
+        path (array[float]): the next chunkSize rows of the path, each row 
+        ordered x positon, y postion, x velocity, y velocity. The last block 
+        may be shorter
+    """
+    
+    if stats is None:
+        for chunk in _path_chunks(tMax, h, P, G, R, d, magnets, method, rtol,
+                                  atol, chunkSize, decimate):
+            yield chunk
+        return
+    
+    _start_stats(stats)
+    samples = [] # time, energy and drift at the start and each chunk end
+    stats['maxEnergyDrift'] = 0.
+    dissipated = 0.
+    lastPower = None # friction power at the end of the previous chunk
+    row = 0
+    
+    start = time.perf_counter()
+    for chunk in _path_chunks(tMax, h, P, G, R, d, magnets, method, rtol, atol,
+                              chunkSize, decimate, stats):
+        split = time.perf_counter()
+        stats['wallTime']['integrate'] += split - start
+        
+        # energy lost to friction, by the trapezoid rule over the saved rows
+        E = pendulum_energy(chunk.T, G, d, magnets)
+        power = R*(chunk[:,2]**2 + chunk[:,3]**2)
+        if lastPower is not None:
+            power = np.concatenate([[lastPower], power])
+        work = dissipated + np.cumsum((power[1:] + power[:-1])/2)*h*decimate
+        if lastPower is None:
+            work = np.concatenate([[0.], work])
+        dissipated = work[-1]
+        lastPower = power[-1]
+        
+        if row == 0:
+            E0 = E[0]
+            samples.append((0., E0, 0.))
+        drift = E + work - E0
+        stats['maxEnergyDrift'] = max(stats['maxEnergyDrift'], 
+                                      np.abs(drift).max())
+        row += len(chunk)
+        samples.append(((row - 1)*h*decimate, E[-1], drift[-1]))
+        
+        stats['wallTime']['energy'] += time.perf_counter() - split
+        yield chunk
+        start = time.perf_counter()
+    
+    stats['wallTime']['integrate'] += time.perf_counter() - start
+    
+    stats['time'], stats['energy'], stats['energyDrift'] = np.array(samples).T
+
+
+def _path_chunks(tMax, h, P, G, R, d, magnets, method, rtol, atol, chunkSize, 
+                 decimate, stats = None):
+    
+    """
+    Does the integration for path_chunks. If stats is given, the force 
+    evaluations, steps and local error estimates are counted in it.
+    """
     
-    for i in range(3):
-        r = np.sqrt((x - xLoc[i])**2 + (y - yLoc[i])**2 + d**2)
-        ax += ((x - xLoc[i])/r**5) * (1 - ((5*d**2)/r**2))
-        ay += ((y - yLoc[i])/r**5) * (1 - ((5*d**2)/r**2))
+    start = time.perf_counter()
+    steps = int(tMax/h)
+    kernel = force_kernel(G, R, d, magnets)
+    if stats is not None:
+        kernel = _counted(kernel, stats)
+    
+    if method == 'rk45':
+        chunks = dopri_chunks(kernel, P, np.arange(0, steps, decimate)*h, h, 
+                              rtol, atol, chunkSize, stats)
+        if stats is not None:
+            stats['wallTime']['setup'] += time.perf_counter() - start
+        
+        for chunk in chunks:
+            P[...] = chunk[-1]
+            yield chunk
+        return
+    
+    step, nStages = INTEGRATORS[method]
+    k = np.empty((nStages,) + P.shape, dtype = P.dtype)
+    nRows = len(range(0, steps, decimate))
+    
+    chunk = np.empty((min(chunkSize, nRows), 4))
+    filled = 0
+    nYielded = 0
+    
+    if stats is not None:
+        stats['wallTime']['setup'] += time.perf_counter() - start
+    
+    for i in range(steps):
+        if i > 0: # row 0 is the starting state
+            step(kernel, P, h, k)
+            
+            if stats is not None:
+                stats['acceptedSteps'] += 1
+                stats['maxErrorEstimate'] = max(_step_error(method, h, k),
+                                                stats['maxErrorEstimate'])
+        
+        if i % decimate == 0:
+            chunk[filled] = P
+            filled += 1
+            
+            if filled == len(chunk):
+                yield chunk
+                nYielded += filled
+                chunk = np.empty((min(chunkSize, nRows - nYielded), 4))
+                filled = 0
+    
+    if filled:
+        yield chunk
+
+
+def save_path(filename, tMax, h, P, G, R, d, magnets = MAGNETS, 
+              method = 'heun', rtol = 1e-6, atol = 1e-9, chunkSize = 10000, 
+              decimate = 1, stats = None):
+    
+    """
+    Writes the path from path_chunks to a .npy file a block at a time through 
+    a memory map, so the whole path is never held in memory.
+    
+    Parameters:
+        filename (str): the .npy file to write the path to
+        
+        See path_chunks for the other parameters
         
-    return np.array([vx, vy, ax, ay])
+    Returns:
+        path (array[float]): read-only memory map of the saved path, of shape
+        (number of rows, 4)
+    """
+    
+    nRows = len(range(0, int(tMax/h), decimate))
+    path = np.lib.format.open_memmap(filename, mode = 'w+', dtype = float, 
+                                     shape = (nRows, 4))
+    
+    row = 0
+    for chunk in path_chunks(tMax, h, P, G, R, d, magnets, method, rtol, atol,
+                             chunkSize, decimate, stats):
+        path[row:row + len(chunk)] = chunk
+        row += len(chunk)
+        path.flush()
+    
+    del path
+    
+    return np.load(filename, mmap_mode = 'r')
 
 
-def calculate_path(tMax, h, P, G, R, d):
+def calculate_path(tMax, h, P, G, R, d, magnets = MAGNETS, method = 'heun',
+                   rtol = 1e-6, atol = 1e-9, stats = None):
     
     """
-    Applies the improved Euler method to find the path that the pendulum takes
-    based on the initial state.
+    Applies the improved Euler method, or another method from INTEGRATORS, to 
+    find the path that the pendulum takes based on the initial state. With 
+    method = 'rk45' the adaptive Dormand-Prince method is used and the path is 
+    interpolated at the same times, so h only sets the output spacing.
     
     Parameters:
         tMax (int): the maximum amount of time the simulation will run,0
@@ -79,6 +657,33 @@ def calculate_path(tMax, h, P, G, R, d):
         R (float): the frictional forces
         
         d (float): the distance in the z direction (vertical distance)
+        
+        magnets (array[float]): an (nMags, 2) array containing the x and y
+        location of each magnet
+        
+        method (str): 'heun', 'rk4' or 'rk45'
+        
+        rtol (float): the relative error tolerance per step for 'rk45'
+        
+        atol (float): the absolute error tolerance per step for 'rk45'
+        
+        stats (dict): if given, it is filled with counters for the run, so 
+        the accuracy of a step size can be checked. Keys:
+            forceEvals: number of calls to the force kernel
+            acceptedSteps, rejectedSteps: number of steps taken and, for 
+            'rk45', rejected by the error control
+            maxErrorEstimate: the largest local error estimate of any step, 
+            or nan for 'rk4', which has no estimate
+            wallTime: seconds spent on 'setup', 'integrate' and 'energy'
+            time, energy: the total energy from pendulum_energy at the start
+            and the end of the path
+            energyDrift: energy plus the energy lost to friction so far, minus
+            the starting energy, at the same times, which would be 0 for an 
+            exact solution. The friction loss is integrated over the rows of 
+            the path with the trapezoid rule, so it is only as accurate as 
+            the row spacing
+            maxEnergyDrift: the largest size of energyDrift at any row
+        When stats is None nothing is counted
     
     Returns:
         path (array[float]): an array of arrays containing all the calculated 
@@ -87,15 +692,10 @@ def calculate_path(tMax, h, P, G, R, d):
     """
     
     steps = int(tMax/h)
-    path = np.empty((steps, 4))
-    path[0] = P
     
-    for i in range(1, steps):
-        f1 = h*dP_dt(P, G, R, d)
-        f2 = h*dP_dt(P + f1, G, R, d)
-        P += (f1 + f2)/2
-        path[i] = P
-        
+    path, = path_chunks(tMax, h, P, G, R, d, magnets, method, rtol, atol, 
+                        chunkSize = steps, stats = stats)
+    
     return path
 
 
@@ -192,10 +792,21 @@ def pendulum_animate(tMax, h, P, G, R, d):
                     fargs = (point, line, path), interval = 0, repeat = True)
 
 
-def calculate_final_position(tMax, h, P, G, R, d):
+def pendulum_animate_decimated(tMax, h, P, G, R, d, fps = 30, speed = 1, 
+                               filename = None, method = 'heun'):
     
     """
-    Finds the final position of the pendulum based on its inital state.
+    Animates the pendulum path like pendulum_animate, but only draws as many 
+    frames as the target frame rate needs, so playback speed does not depend 
+    on the step size or how far the animation has gone.
+    
+    The path is decimated to one point per frame as it is integrated, with 
+    path_chunks, so the full path is never stored. Only the moving pendulum 
+    and its trail are redrawn each frame (blitting).
+    
+    If filename is given, the animation is written to it without opening a 
+    window, using an off-screen figure: a .gif is written with Pillow and any 
+    other extension (such as .mp4) is piped to ffmpeg.
     
     Parameters:
         tMax (int): the maximum amount of time the simulation will run, 
@@ -204,75 +815,558 @@ def calculate_final_position(tMax, h, P, G, R, d):
         h (float): the step size
         
         P (array[float]): the inital state of the system. An array of x and y 
-        positions and the x and y velocities.
+        positions and the x and y velocities. Order: x positon, y postion, x 
+        velocity, y velocity
         
         G (float): the force due to gravity
 
         R (float): the frictional forces
         
         d (float): the distance in the z direction (vertical distance)
+        
+        fps (int): number of frames per second of playback
+        
+        speed (float): number of simulated seconds per second of playback
+        
+        filename (str): the file to save the animation to, if any
+        
+        method (str): the integration method used by calculate_path
     
     Returns:
-        P (array[float]): final state of the pendulum. Order: x positon, y postion, 
-        x velocity, y velocity
+        function animation
     """
     
-    steps = int(tMax/h)
+    stride = max(1, int(round(speed/(fps*h)))) # steps per frame
+    frames = np.concatenate(list(path_chunks(tMax, h, P, G, R, d, 
+                                             method = method, 
+                                             decimate = stride)))[:,:2]
+    nFrames = len(frames)
     
-    for i in range(1, steps):
-        f1 = h*dP_dt(P, G, R, d)
-        f2 = h*dP_dt(P + f1, G, R, d)
-        P += (f1 + f2)/2
+    if filename is None:
+        fig, ax = plt.subplots(figsize = (8, 8))
+    else:
+        fig = Figure(figsize = (8, 8))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+    ax.set_aspect('equal')
     
-    return P
+    point, = ax.plot([], [], 'ko')
+    line, = ax.plot([], [], 'k')
+    
+    ax.plot(1, 0, 'ro')
+    ax.plot(-0.5, np.sqrt(3)/2, 'go')
+    ax.plot(-0.5, -np.sqrt(3)/2, 'bo')
+    
+    width = 0.25 + np.amax(np.abs(frames)) # finds the largest x or y value and adds 0.25
+    ax.set_xlim(-width, width)
+    ax.set_ylim(-width, width)
+    
+    def init():
+        
+        """
+        Clears the pendulum and its trail
+        """
+        
+        point.set_data([], [])
+        line.set_data([], [])
+        
+        return point, line,
+    
+    def animate(frame):
+        
+        """
+        Extends the trail to the next point and moves the pendulum
+        """
+        
+        point.set_data(frames[frame:frame + 1,0], frames[frame:frame + 1,1])
+        line.set_data(frames[:frame + 1,0], frames[:frame + 1,1])
+        
+        return point, line,
+    
+    anim = animation.FuncAnimation(fig, animate, frames = nFrames, 
+                                   init_func = init, interval = 1000/fps, 
+                                   blit = True, repeat = filename is None)
+    
+    if filename is not None:
+        if filename.lower().endswith('.gif'):
+            writer = animation.PillowWriter(fps = fps)
+        else:
+            writer = animation.FFMpegWriter(fps = fps)
+        anim.save(filename, writer = writer)
+    
+    return anim
 
 
-def color_grid(tMax, nPts, h, G, R, d):
+def calculate_final_position(tMax, h, P, G, R, d, magnets = MAGNETS, 
+                             method = 'heun', rtol = 1e-6, atol = 1e-9, 
+                             stats = None):
     
     """
-    Used to visually show what magnet the pendulum will end up over if it
-    starts in a specific location.
+    Finds the final position of the pendulum based on its inital state. The
+    method is chosen the same way as in calculate_path.
     
     Parameters:
         tMax (int): the maximum amount of time the simulation will run, 
         in seconds
-        
-        nPts (int): number of x and y points
     
         h (float): the step size
         
+        P (array[float]): the inital state of the system. An array of x and y 
+        positions and the x and y velocities.
+        
         G (float): the force due to gravity
 
         R (float): the frictional forces
         
         d (float): the distance in the z direction (vertical distance)
+        
+        magnets (array[float]): an (nMags, 2) array containing the x and y
+        location of each magnet
+        
+        method (str): 'heun', 'rk4' or 'rk45'
+        
+        rtol (float): the relative error tolerance per step for 'rk45'
+        
+        atol (float): the absolute error tolerance per step for 'rk45'
+    
+        stats (dict): if given, it is filled with the same counters as in 
+        calculate_path, apart from the energy
     
     Returns:
-        None
+        P (array[float]): final state of the pendulum. Order: x positon, y postion, 
+        x velocity, y velocity
     """
     
-    width = 5
-    xPts = np.linspace(-width, width, nPts)
-    yPts = np.linspace(-width, width, nPts)
-    X, Y = np.meshgrid(xPts, yPts)
-    VX, VY = np.zeros((2, nPts, nPts))
-    P0 = np.array([X, Y, VX, VY])
+    start = time.perf_counter()
+    steps = int(tMax/h)
+    kernel = force_kernel(G, R, d, magnets)
+    if stats is not None:
+        _start_stats(stats)
+        kernel = _counted(kernel, stats)
     
-    P = calculate_final_position(tMax, h, P0, G, R, d)
+    if method == 'rk45':
+        P[...] = dopri_dense(kernel, P, [(steps - 1)*h], h, rtol, atol, 
+                             stats)[0]
+    else:
+        step, nStages = INTEGRATORS[method]
+        k = np.empty((nStages,) + P.shape, dtype = P.dtype)
+        
+        if stats is None:
+            for i in range(1, steps):
+                step(kernel, P, h, k)
+        else:
+            stats['wallTime']['setup'] = time.perf_counter() - start
+            for i in range(1, steps):
+                step(kernel, P, h, k)
+                stats['maxErrorEstimate'] = max(_step_error(method, h, k),
+                                                stats['maxErrorEstimate'])
+            stats['acceptedSteps'] = steps - 1
     
-    magnets = np.array([[1, 0], [-0.5, np.sqrt(3)/2], [-0.5, -np.sqrt(3)/2]])
-    magnetColors = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype = float)
+    if stats is not None:
+        stats['wallTime']['integrate'] = (time.perf_counter() - start 
+                                          - stats['wallTime']['setup'])
     
-    X, Y = P[:2]
-    xMags = magnets[:,0]
-    yMags = magnets[:,1]
-    nMags = len(magnets)
+    return P
+
+
+def calculate_settled_positions(tMax, h, P, G, R, d, magnets = MAGNETS, 
+                                method = 'heun', speedTol = 0.05, 
+                                radius = 0.5, checkEvery = 50, nChecks = 3,
+                                dtype = np.float64, stats = None):
     
-    xDiffs = X - xMags.reshape(nMags, 1, 1)
-    yDiffs = Y - yMags.reshape(nMags, 1, 1)
-    distSquared = xDiffs**2 + yDiffs**2
+    """
+    Finds the final position of a batch of pendulums like 
+    calculate_final_position, but stops advancing each pendulum once it has 
+    settled over a magnet.
+    
+    Every checkEvery steps, a pendulum that is moving slower than speedTol 
+    within radius of a magnet is counted as settling. Once this has been true 
+    for nChecks checks in a row its state is recorded as final and it is 
+    removed from the active set, so later steps only advance the pendulums 
+    that are still moving.
+    
+    Parameters:
+        tMax (int): the maximum amount of time the simulation will run, 
+        in seconds
+    
+        h (float): the step size
+        
+        P (array[float]): the inital states of the system, of shape (4, ...). 
+        Order: x positon, y postion, x velocity, y velocity
+        
+        G (float or array[float]): the force due to gravity, which can be 
+        given separately for every state as an array of shape P.shape[1:]
+
+        R (float or array[float]): the frictional forces, or an array of them
+        
+        d (float or array[float]): the distance in the z direction (vertical 
+        distance), or an array of them
+        
+        magnets (array[float]): an (nMags, 2) array containing the x and y
+        location of each magnet
+        
+        method (str): a fixed step method from INTEGRATORS
+        
+        speedTol (float): the speed below which a pendulum may be settled
+        
+        radius (float): the distance from a magnet within which a pendulum 
+        may be settled
+        
+        checkEvery (int): number of steps between convergence checks
+        
+        nChecks (int): number of checks in a row a pendulum must pass to be 
+        settled
+        
+        dtype (type): the precision to integrate in, np.float64 or np.float32
+        
+        stats (dict): if given, it is filled with the same counters as in 
+        calculate_final_position. acceptedSteps counts the steps of the 
+        batch, and maxErrorEstimate is taken over the pendulums still moving
+    
+    Returns:
+        P (array[float]): final states of the pendulums, the same shape as P
+        
+        settleTime (array[float]): the time each pendulum was found to be 
+        settled, or nan if it was still moving at tMax
+    """
+    
+    start = time.perf_counter()
+    if stats is not None:
+        _start_stats(stats)
+    
+    shape = np.shape(P)
+    final = np.array(P, dtype = dtype).reshape(4, -1)
+    n = final.shape[1]
+    settleTime = np.full(n, np.nan)
+    
+    # per-state parameters are flattened so they can be compacted with P
+    params = [np.broadcast_to(v, shape[1:]).reshape(-1) if np.ndim(v) else v 
+              for v in (G, R, d)]
+    perState = any(np.ndim(v) for v in params)
+    
+    steps = int(tMax/h)
+    kernel = force_kernel(*params, magnets)
+    if stats is not None:
+        kernel = _counted(kernel, stats)
+    step, nStages = INTEGRATORS[method]
+    mags = np.asarray(magnets, dtype = dtype).T.reshape(2, -1, 1)
+    
+    active = np.arange(n)
+    Pa = final.copy()
+    k = np.empty((nStages,) + Pa.shape, dtype = dtype)
+    passed = np.zeros(n, dtype = int) # checks passed in a row
+    
+    if stats is not None:
+        stats['wallTime']['setup'] = time.perf_counter() - start
+    
+    for i in range(1, steps):
+        step(kernel, Pa, h, k)
+        
+        if stats is not None:
+            stats['acceptedSteps'] += 1
+            stats['maxErrorEstimate'] = max(_step_error(method, h, k),
+                                            stats['maxErrorEstimate'])
+        
+        if i % checkEvery == 0:
+            speed2 = Pa[2]**2 + Pa[3]**2
+            dist2 = np.min(((Pa[:2,None] - mags)**2).sum(axis = 0), axis = 0)
+            settling = (speed2 < speedTol**2) & (dist2 < radius**2)
+            passed = np.where(settling, passed + 1, 0)
+            done = passed >= nChecks
+            
+            if done.any():
+                final[:,active[done]] = Pa[:,done]
+                settleTime[active[done]] = i*h
+                
+                keep = ~done
+                active = active[keep]
+                Pa = np.ascontiguousarray(Pa[:,keep])
+                passed = passed[keep]
+                k = np.empty((nStages,) + Pa.shape, dtype = dtype)
+                
+                if len(active) == 0:
+                    break
+                
+                if perState:
+                    kernel = force_kernel(*[v[active] if np.ndim(v) else v 
+                                            for v in params], magnets)
+                    if stats is not None:
+                        kernel = _counted(kernel, stats)
+    
+    final[:,active] = Pa
+    
+    if stats is not None:
+        stats['wallTime']['integrate'] = (time.perf_counter() - start 
+                                          - stats['wallTime']['setup'])
+    
+    return final.reshape(shape), settleTime.reshape(shape[1:])
+
+
+def closest_magnet(P, magnets = MAGNETS):
+    
+    """
+    Finds the index of the magnet closest to each pendulum position.
+    
+    Parameters:
+        P (array[float]): states of the system, of shape (4, ...)
+        
+        magnets (array[float]): an (nMags, 2) array containing the x and y
+        location of each magnet
+        
+    Returns:
+        closest (array[int]): the index of the closest magnet, of shape 
+        P.shape[1:]
+    """
+    
+    X, Y = P[:2]
+    xMags = magnets[:,0]
+    yMags = magnets[:,1]
+    nMags = len(magnets)
+    
+    xDiffs = X - xMags.reshape((nMags,) + (1,)*X.ndim)
+    yDiffs = Y - yMags.reshape((nMags,) + (1,)*Y.ndim)
+    distSquared = xDiffs**2 + yDiffs**2
     closest = np.argmin(distSquared, axis = 0) # index of min value
     
+    return closest
+
+
+def basin_map(tMax, nPts, h, G, R, d, magnets = MAGNETS, method = 'heun', 
+              earlyExit = True, width = 5, dtype = np.float64, stats = None):
+    
+    """
+    Finds what magnet the pendulum will end up over for every start position 
+    on an nPts x nPts grid, starting at rest.
+    
+    Parameters:
+        tMax (int): the maximum amount of time the simulation will run, 
+        in seconds
+        
+        nPts (int): number of x and y points
+    
+        h (float): the step size
+        
+        G (float): the force due to gravity
+
+        R (float): the frictional forces
+        
+        d (float): the distance in the z direction (vertical distance)
+        
+        magnets (array[float]): an (nMags, 2) array containing the x and y
+        location of each magnet
+        
+        method (str): a method from INTEGRATORS, or 'rk45' when earlyExit is 
+        False
+        
+        earlyExit (bool): stop advancing pendulums once they have settled, 
+        using calculate_settled_positions
+        
+        width (float): the grid covers -width to width in x and y
+        
+        dtype (type): the precision to integrate in. np.float32 halves the 
+        memory traffic per step, and comparing its basin map with the 
+        np.float64 one shows how sensitive the map is to rounding
+        
+        stats (dict): if given, it is filled with the counters of the run, 
+        as in calculate_settled_positions or calculate_final_position, to 
+        check whether h is small enough for the map
+    
+    Returns:
+        closest (array[int]): the index of the closest magnet at the end of 
+        the run, of shape (nPts, nPts)
+        
+        P (array[float]): final states of the pendulums, of shape 
+        (4, nPts, nPts)
+    """
+    
+    xPts = np.linspace(-width, width, nPts)
+    yPts = np.linspace(-width, width, nPts)
+    X, Y = np.meshgrid(xPts, yPts)
+    VX, VY = np.zeros((2, nPts, nPts))
+    P0 = np.array([X, Y, VX, VY])
+    
+    return basin_from_states(tMax, h, P0, G, R, d, magnets, method, earlyExit,
+                             dtype, stats)
+
+
+def basin_from_states(tMax, h, P0, G, R, d, magnets = MAGNETS, method = 'heun',
+                      earlyExit = True, dtype = np.float64, stats = None):
+    
+    """
+    Finds what magnet the pendulum will end up over for any array of start 
+    states. See basin_map for the parameters.
+    
+    Returns:
+        closest (array[int]): the index of the closest magnet at the end of 
+        the run, of shape P0.shape[1:]
+        
+        P (array[float]): final states of the pendulums, the same shape as P0
+    """
+    
+    if earlyExit:
+        P, settleTime = calculate_settled_positions(tMax, h, P0, G, R, d, 
+                                                    magnets, method, 
+                                                    dtype = dtype, 
+                                                    stats = stats)
+    else:
+        P = calculate_final_position(tMax, h, P0.astype(dtype), G, R, d, 
+                                     magnets, method, stats = stats)
+    
+    return closest_magnet(P, magnets), P
+
+
+def _basin_cache_key(tMax, h, G, R, d, magnets, method, earlyExit, width, 
+                     dtype):
+    
+    """
+    Hashes every parameter that affects a basin map except the number of grid
+    points, so grids of different resolutions share the same key.
+    """
+    
+    params = [tMax, h, G, R, d, np.asarray(magnets, dtype = float), method, 
+              earlyExit, width, np.dtype(dtype).name]
+    # numpy scalars, e.g. from a np.linspace sweep, become the Python numbers
+    # json can write
+    params = [v.tolist() if isinstance(v, (np.ndarray, np.generic)) else v 
+              for v in params]
+    
+    return hashlib.sha1(json.dumps(params).encode()).hexdigest()[:20]
+
+
+def cached_basin_map(tMax, nPts, h, G, R, d, magnets = MAGNETS, 
+                     method = 'heun', earlyExit = True, width = 5, 
+                     dtype = np.float64, cacheDir = 'basin_cache', 
+                     maxBytes = 2**28):
+    
+    """
+    Same as basin_map, but keeps the results in a cache of compressed .npz 
+    files on disk, keyed by a hash of the physical parameters, the magnet 
+    layout and the integrator.
+    
+    When a grid is not cached but a coarser grid with the same parameters is, 
+    and every coarse grid point is also a point of the requested grid (that 
+    is, nPts - 1 is a multiple of the coarse nPts - 1), the coarse results are
+    reused and only the new points are integrated.
+    
+    Once the cache holds more than maxBytes, the least recently used files are
+    deleted.
+    
+    Parameters:
+        See basin_map for the other parameters
+        
+        cacheDir (str): the directory to keep the cached results in
+        
+        maxBytes (int): the maximum total size of the cache, in bytes
+    
+    Returns:
+        closest (array[int]): the index of the closest magnet at the end of 
+        the run, of shape (nPts, nPts)
+        
+        P (array[float]): final states of the pendulums, of shape 
+        (4, nPts, nPts)
+    """
+    
+    key = _basin_cache_key(tMax, h, G, R, d, magnets, method, earlyExit, 
+                           width, dtype)
+    filename = os.path.join(cacheDir, '{}_{}.npz'.format(key, nPts))
+    
+    if os.path.exists(filename):
+        os.utime(filename) # mark as recently used
+        with np.load(filename) as cached:
+            return cached['closest'], cached['P']
+    
+    os.makedirs(cacheDir, exist_ok = True)
+    
+    # find the finest cached grid whose points are all on the requested grid
+    coarse = None
+    for name in glob.glob(os.path.join(cacheDir, key + '_*.npz')):
+        n = int(os.path.splitext(name)[0].rsplit('_', 1)[1])
+        if 1 < n < nPts and (nPts - 1) % (n - 1) == 0:
+            if coarse is None or n > coarse[0]:
+                coarse = (n, name)
+    
+    xPts = np.linspace(-width, width, nPts)
+    yPts = np.linspace(-width, width, nPts)
+    X, Y = np.meshgrid(xPts, yPts)
+    VX, VY = np.zeros((2, nPts, nPts))
+    P0 = np.array([X, Y, VX, VY])
+    
+    if coarse is None:
+        closest, P = basin_from_states(tMax, h, P0, G, R, d, magnets, method,
+                                       earlyExit, dtype)
+    else:
+        n, name = coarse
+        step = (nPts - 1)//(n - 1)
+        os.utime(name)
+        
+        P = np.empty(P0.shape, dtype = dtype)
+        with np.load(name) as cached:
+            P[:,::step,::step] = cached['P']
+        
+        new = np.ones((nPts, nPts), dtype = bool)
+        new[::step,::step] = False
+        P[:,new] = basin_from_states(tMax, h, P0[:,new], G, R, d, magnets, 
+                                     method, earlyExit, dtype)[1]
+        closest = closest_magnet(P, magnets)
+    
+    np.savez_compressed(filename, closest = closest, P = P)
+    
+    # evict the least recently used files until the cache fits in maxBytes
+    files = sorted(glob.glob(os.path.join(cacheDir, '*.npz')), 
+                   key = os.path.getmtime)
+    total = sum(os.path.getsize(name) for name in files)
+    for name in files:
+        if total <= maxBytes or name == filename:
+            break
+        total -= os.path.getsize(name)
+        os.remove(name)
+    
+    return closest, P
+
+
+def color_grid(tMax, nPts, h, G, R, d, earlyExit = True, dtype = np.float64,
+               cacheDir = None):
+    
+    """
+    Used to visually show what magnet the pendulum will end up over if it
+    starts in a specific location.
+    
+    Parameters:
+        tMax (int): the maximum amount of time the simulation will run, 
+        in seconds
+        
+        nPts (int): number of x and y points
+    
+        h (float): the step size
+        
+        G (float): the force due to gravity
+
+        R (float): the frictional forces
+        
+        d (float): the distance in the z direction (vertical distance)
+        
+        earlyExit (bool): stop advancing pendulums once they have settled 
+        over a magnet
+        
+        dtype (type): the precision to integrate in, np.float64 or np.float32
+        
+        cacheDir (str): if given, the basin map is cached in this directory 
+        with cached_basin_map
+    
+    Returns:
+        None
+    """
+    
+    if cacheDir is None:
+        closest, P = basin_map(tMax, nPts, h, G, R, d, earlyExit = earlyExit, 
+                               dtype = dtype)
+    else:
+        closest, P = cached_basin_map(tMax, nPts, h, G, R, d, 
+                                      earlyExit = earlyExit, dtype = dtype, 
+                                      cacheDir = cacheDir)
+    
+    magnetColors = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype = float)
+    
     plt.figure(figsize = (8, 8))
     img = magnetColors[closest]
     plt.imshow(img, interpolation = 'None')
@@ -280,62 +1374,340 @@ def color_grid(tMax, nPts, h, G, R, d):
     plt.yticks([])
     
 
-# Pendulum Plots
-# Initial State 1
-# tmax = 100, h = 0.01, G = 1, R = 0.5, d = 1
-# start at (1,1)
-plt.figure(figsize = (6, 6))
-plt.gca().set_aspect('equal')
-P0 = np.array([1., 1., 0.5, 0.5])
-plot_path(100, 0.01, P0, 1., 0.5, 1.)
-plt.title('Initial State 1')
-
-# Initial State 2
-# tmax = 100, h = 0.01, G = 1, R = 0.5, d = 1
-# start at origin with small velocities
-plt.figure(figsize = (6, 6))
-plt.gca().set_aspect('equal')
-P0 = np.array([0, 0, 0.1, 0.1])
-plot_path(100, 0.01, P0, 1., 0.5, 1.)
-plt.title('Initial State 2')
-
-# Initial State 3
-# tmax = 100, h = 0.01, G = 2, R = 0.5, d = 1
-# start at origin with no x velocity
-plt.figure(figsize = (6, 6))
-plt.gca().set_aspect('equal')
-P0 = np.array([0, 0, 0, 2.])
-plot_path(100, 0.01, P0, 2, 0.5, 1.)
-plt.title('Initial State 3')
-
-# Initial State 4
-# tmax = 100, h = 0.01, G = 1.5, R = 1, d = 1
-# start at (2,2) and large velocities
-plt.figure(figsize = (6, 6))
-plt.gca().set_aspect('equal')
-P0 = np.array([0, 0, 5., 5.])
-plot_path(100, 0.01, P0, 1.5, 1., 1.)
-plt.title('Initial State 4')
-
-
-# Color Grid 1
-color_grid(100, 100, 0.01, 1, 0.5, 1)
-
-# Color Grid 2
-color_grid(50, 25, 0.01, 1, 0.1, 1)
-
-# Color Grid 3
-color_grid(50, 25, 0.01, 1, 0.65, 1)
-
-# Color Grid 4
-color_grid(50, 25, 0.01, 1, 10, 1)
-
-
-# Animate the Pendulum
-"""
-NOTE: To run the animation, you must enter %matplotlib qt5 into the IPython console
-before running. Then enter the following two lines into the console. Or, comment
-out all other pendulum plots in the file, uncomment the two lines, then run the file.
-"""
-# P0 = np.array([0.5, 0.5, 3., 3.])
-# pendulum_animate(100, 0.01, P0, 1., 0.5, 1.)
\ No newline at end of file
+def boundary_dimension(closest):
+    
+    """
+    Estimates the fractal dimension of the boundaries between basins by box 
+    counting. A pixel is on a boundary if the pixel to its right or below it 
+    ends up over a different magnet.
+    
+    Parameters:
+        closest (array[int]): an (nPts, nPts) basin map, as returned by 
+        basin_map
+        
+    Returns:
+        dimension (float): the slope of log(number of boxes containing a 
+        boundary) against log(1/box size), or nan if there is no boundary
+    """
+    
+    boundary = np.zeros(closest.shape, dtype = bool)
+    boundary[:,:-1] |= closest[:,1:] != closest[:,:-1]
+    boundary[:-1] |= closest[1:] != closest[:-1]
+    
+    if not boundary.any():
+        return np.nan
+    
+    sizes = 2**np.arange(int(np.log2(min(closest.shape))))
+    counts = []
+    for size in sizes:
+        nRows, nCols = np.array(boundary.shape)//size
+        boxes = boundary[:nRows*size,:nCols*size].reshape(nRows, size, 
+                                                          nCols, size)
+        counts.append(boxes.any(axis = (1, 3)).sum())
+    
+    if len(sizes) < 2:
+        return np.nan
+    
+    slope, intercept = np.polyfit(np.log(1/sizes), np.log(counts), 1)
+    
+    return slope
+
+
+def parameter_sweep(tMax, nPts, h, Gs, Rs, ds, magnets = MAGNETS, 
+                    method = 'heun', width = 5, dtype = np.float64, 
+                    returnMaps = False):
+    
+    """
+    Computes basin maps for every combination of the given gravity, friction 
+    and distance values in one batched integration. The configurations are 
+    stacked along an extra axis of the start states, with the parameters 
+    given per state, so all of them are advanced by the same steps and 
+    settled pendulums are dropped from every configuration at once.
+    
+    Parameters:
+        tMax (int): the maximum amount of time the simulation will run, 
+        in seconds
+        
+        nPts (int): number of x and y points
+    
+        h (float): the step size
+        
+        Gs (array[float]): values of the force due to gravity
+        
+        Rs (array[float]): values of the frictional forces
+        
+        ds (array[float]): values of the distance in the z direction
+        
+        magnets (array[float]): an (nMags, 2) array containing the x and y
+        location of each magnet
+        
+        method (str): a fixed step method from INTEGRATORS
+        
+        width (float): the grid covers -width to width in x and y
+        
+        dtype (type): the precision to integrate in, np.float64 or np.float32
+        
+        returnMaps (bool): also return the basin map of every configuration
+    
+    Returns:
+        summary (array): a structured array with one entry per configuration,
+        in the order of np.meshgrid(Gs, Rs, ds, indexing = 'ij'). Fields:
+            G, R, d: the parameters of the configuration
+            fractions: the fraction of start positions that end up over each 
+            magnet
+            dimension: the box counting dimension of the basin boundaries
+            settleTime: the mean settling time, counting pendulums that never 
+            settled as tMax
+            unsettled: the fraction of pendulums still moving at tMax
+        
+        closest (array[int]): if returnMaps is True, the basin maps, of shape
+        (nConfigs, nPts, nPts)
+    """
+    
+    G, R, d = [v.reshape(-1, 1, 1) for v in 
+               np.meshgrid(Gs, Rs, ds, indexing = 'ij')]
+    nConfigs = len(G)
+    nMags = len(magnets)
+    
+    xPts = np.linspace(-width, width, nPts)
+    yPts = np.linspace(-width, width, nPts)
+    X, Y = np.meshgrid(xPts, yPts)
+    P0 = np.zeros((4, nConfigs, nPts, nPts))
+    P0[0] = X
+    P0[1] = Y
+    
+    P, settleTime = calculate_settled_positions(tMax, h, P0, G, R, d, 
+                                                magnets, method, 
+                                                dtype = dtype)
+    closest = closest_magnet(P, magnets)
+    
+    summary = np.empty(nConfigs, dtype = [('G', float), ('R', float), 
+                                          ('d', float), 
+                                          ('fractions', float, (nMags,)),
+                                          ('dimension', float), 
+                                          ('settleTime', float), 
+                                          ('unsettled', float)])
+    summary['G'] = G.ravel()
+    summary['R'] = R.ravel()
+    summary['d'] = d.ravel()
+    
+    flat = closest.reshape(nConfigs, -1)
+    counts = np.zeros((nConfigs, nMags))
+    np.add.at(counts, (np.arange(nConfigs)[:,None], flat), 1)
+    summary['fractions'] = counts/flat.shape[1]
+    summary['dimension'] = [boundary_dimension(c) for c in closest]
+    
+    unsettled = np.isnan(settleTime).reshape(nConfigs, -1)
+    times = np.where(unsettled, tMax, settleTime.reshape(nConfigs, -1))
+    summary['settleTime'] = times.mean(axis = 1)
+    summary['unsettled'] = unsettled.mean(axis = 1)
+    
+    if returnMaps:
+        return summary, closest
+    
+    return summary
+
+
+def _render_tile(task):
+    
+    """
+    Computes one tile of a basin image and writes it straight into the 
+    memory-mapped image file. Runs in a worker process of render_basin.
+    """
+    
+    (filename, index, rows, cols, xPts, yPts, tMax, h, G, R, d, magnets, 
+     method, dtype) = task
+    
+    X, Y = np.meshgrid(xPts[cols[0]:cols[1]], yPts[rows[0]:rows[1]])
+    VX, VY = np.zeros((2,) + X.shape)
+    P0 = np.array([X, Y, VX, VY])
+    closest, P = basin_from_states(tMax, h, P0, G, R, d, magnets, method, 
+                                   dtype = dtype)
+    
+    image = np.lib.format.open_memmap(filename, mode = 'r+')
+    image[rows[0]:rows[1], cols[0]:cols[1]] = closest
+    image.flush()
+    del image
+    
+    return index
+
+
+def render_basin(filename, tMax, nPts, h, G, R, d, magnets = MAGNETS, 
+                 method = 'heun', width = 5, tileSize = 256, nWorkers = None,
+                 dtype = np.float64):
+    
+    """
+    Renders a high resolution basin-of-attraction image, the same as 
+    basin_map, by splitting the grid of start positions into tiles and 
+    integrating the tiles in a pool of worker processes.
+    
+    The image is an (nPts, nPts) uint8 .npy file of magnet indices that every
+    worker opens as a memory map and writes its finished tile into directly,
+    so the full grid is never held in memory by any one process. Unfinished 
+    pixels hold 255.
+    
+    Finished tiles are recorded in a checkpoint file next to the image 
+    (filename + '.json'). If a render with the same parameters is interrupted,
+    calling render_basin again resumes it and only computes the missing tiles.
+    
+    Parameters:
+        filename (str): the .npy file to write the image to
+        
+        tMax (int): the maximum amount of time the simulation will run, 
+        in seconds
+        
+        nPts (int): number of x and y points
+    
+        h (float): the step size
+        
+        G (float): the force due to gravity
+
+        R (float): the frictional forces
+        
+        d (float): the distance in the z direction (vertical distance)
+        
+        magnets (array[float]): an (nMags, 2) array containing the x and y
+        location of each magnet
+        
+        method (str): a fixed step method from INTEGRATORS
+        
+        width (float): the grid covers -width to width in x and y
+        
+        tileSize (int): number of x and y points in each tile
+        
+        nWorkers (int): number of worker processes, defaults to the number of
+        CPUs
+        
+        dtype (type): the precision to integrate in, np.float64 or np.float32
+    
+    Returns:
+        image (array[int]): read-only memory map of the finished image
+    """
+    
+    magnets = np.asarray(magnets, dtype = float)
+    checkpoint = filename + '.json'
+    params = {'tMax': tMax, 'nPts': nPts, 'h': h, 'G': G, 'R': R, 'd': d, 
+              'magnets': magnets, 'method': method, 'width': width, 
+              'tileSize': tileSize, 'dtype': np.dtype(dtype).name}
+    params = {key: value.tolist() # json can't write numpy scalars
+              if isinstance(value, (np.ndarray, np.generic)) else value 
+              for key, value in params.items()}
+    
+    done = set()
+    if os.path.exists(checkpoint) and os.path.exists(filename):
+        with open(checkpoint) as file:
+            state = json.load(file)
+        if state['params'] == params:
+            done = set(state['done'])
+    
+    if not done:
+        image = np.lib.format.open_memmap(filename, mode = 'w+', 
+                                          dtype = np.uint8, 
+                                          shape = (nPts, nPts))
+        image[:] = 255
+        image.flush()
+        del image
+    
+    xPts = np.linspace(-width, width, nPts)
+    yPts = np.linspace(-width, width, nPts)
+    
+    tasks = []
+    for i, row in enumerate(range(0, nPts, tileSize)):
+        for j, col in enumerate(range(0, nPts, tileSize)):
+            index = '{},{}'.format(i, j)
+            if index not in done:
+                tasks.append((filename, index, 
+                              (row, min(row + tileSize, nPts)),
+                              (col, min(col + tileSize, nPts)), 
+                              xPts, yPts, tMax, h, G, R, d, magnets, method,
+                              dtype))
+    
+    def save_checkpoint():
+        with open(checkpoint + '.tmp', 'w') as file:
+            json.dump({'params': params, 'done': sorted(done)}, file)
+        os.replace(checkpoint + '.tmp', checkpoint)
+    
+    if tasks:
+        with multiprocessing.Pool(nWorkers) as pool:
+            for index in pool.imap_unordered(_render_tile, tasks):
+                done.add(index)
+                save_checkpoint()
+    
+    return np.load(filename, mmap_mode = 'r')
+
+
+if __name__ == '__main__':
+    # Pendulum Plots
+    # Initial State 1
+    # tmax = 100, h = 0.01, G = 1, R = 0.5, d = 1
+    # start at (1,1)
+    plt.figure(figsize = (6, 6))
+    plt.gca().set_aspect('equal')
+    P0 = np.array([1., 1., 0.5, 0.5])
+    plot_path(100, 0.01, P0, 1., 0.5, 1.)
+    plt.title('Initial State 1')
+
+    # Initial State 2
+    # tmax = 100, h = 0.01, G = 1, R = 0.5, d = 1
+    # start at origin with small velocities
+    plt.figure(figsize = (6, 6))
+    plt.gca().set_aspect('equal')
+    P0 = np.array([0, 0, 0.1, 0.1])
+    plot_path(100, 0.01, P0, 1., 0.5, 1.)
+    plt.title('Initial State 2')
+
+    # Initial State 3
+    # tmax = 100, h = 0.01, G = 2, R = 0.5, d = 1
+    # start at origin with no x velocity
+    plt.figure(figsize = (6, 6))
+    plt.gca().set_aspect('equal')
+    P0 = np.array([0, 0, 0, 2.])
+    plot_path(100, 0.01, P0, 2, 0.5, 1.)
+    plt.title('Initial State 3')
+
+    # Initial State 4
+    # tmax = 100, h = 0.01, G = 1.5, R = 1, d = 1
+    # start at (2,2) and large velocities
+    plt.figure(figsize = (6, 6))
+    plt.gca().set_aspect('equal')
+    P0 = np.array([0, 0, 5., 5.])
+    plot_path(100, 0.01, P0, 1.5, 1., 1.)
+    plt.title('Initial State 4')
+
+
+    # Color Grid 1
+    color_grid(100, 100, 0.01, 1, 0.5, 1)
+
+    # Color Grid 2
+    color_grid(50, 25, 0.01, 1, 0.1, 1)
+
+    # Color Grid 3
+    color_grid(50, 25, 0.01, 1, 0.65, 1)
+
+    # Color Grid 4
+    color_grid(50, 25, 0.01, 1, 10, 1)
+
+
+    # Animate the Pendulum
+    """
+    NOTE: To run the animation, you must enter %matplotlib qt5 into the IPython console
+    before running. Then enter the following two lines into the console. Or, comment
+    out all other pendulum plots in the file, uncomment the two lines, then run the file.
+    """
+    # P0 = np.array([0.5, 0.5, 3., 3.])
+    # pendulum_animate(100, 0.01, P0, 1., 0.5, 1.)
+    
+    # The decimated animation plays back in real time, and can be saved 
+    # without a window
+    # P0 = np.array([0.5, 0.5, 3., 3.])
+    # pendulum_animate_decimated(100, 0.01, P0, 1., 0.5, 1., 
+    #                            filename = 'pendulum.gif')
+
+
+    # High Resolution Color Grid
+    """
+    NOTE: render_basin uses every CPU core and writes the image to disk as it 
+    goes. If it is interrupted, running the same line again resumes it.
+    """
+    # image = render_basin('basin.npy', 50, 4096, 0.01, 1, 0.5, 1)
+    # plt.imshow(np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]])[image[::4,::4]])
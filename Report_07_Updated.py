@@ -27,121 +27,1117 @@ bouncing on a hard surface
 """
 
 
+import asyncio
+import csv
+import functools
+import glob
+import multiprocessing
+import os
+import struct
+from time import perf_counter
+
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
-from scipy.io import wavfile
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
+from scipy.signal import find_peaks
+
+
+def wav_info(filename):
+    
+    """
+    Reads the header of a .wav file without reading the audio data.
+    
+    Parameters:
+        filename (str): the .wav file
+        
+    Returns:
+        info (dict): the sampling rate ('rate'), number of channels 
+        ('channels'), bits per sample ('bits'), whether the samples are 
+        floating point ('float'), the byte offset of the audio data 
+        ('offset') and the number of frames, one sample per channel, 
+        ('nFrames')
+    """
+    
+    with open(filename, 'rb') as file:
+        header = file.read(12)
+        if (len(header) < 12 or header[:4] not in (b'RIFF', b'RF64') 
+                or header[8:] != b'WAVE'):
+            raise ValueError('{} is not a .wav file'.format(filename))
+        
+        info = {}
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                raise ValueError('{} has no data chunk'.format(filename))
+            chunkId, chunkSize = struct.unpack('<4sI', header)
+            
+            if chunkId == b'fmt ':
+                fmt = file.read(chunkSize)
+                if len(fmt) < 16:
+                    raise ValueError('{} has a malformed fmt chunk'
+                                     .format(filename))
+                code, channels, rate = struct.unpack('<HHI', fmt[:8])
+                bits, = struct.unpack('<H', fmt[14:16])
+                if code == 0xFFFE: # extensible format, real code follows
+                    if len(fmt) < 26:
+                        raise ValueError('{} has a malformed fmt chunk'
+                                         .format(filename))
+                    code, = struct.unpack('<H', fmt[24:26])
+                if code not in (1, 3):
+                    raise ValueError('only PCM and float .wav files are '
+                                     'supported')
+                if channels == 0 or bits not in (8, 16, 24, 32, 64):
+                    raise ValueError('{} has a malformed fmt chunk'
+                                     .format(filename))
+                info.update(rate = rate, channels = channels, bits = bits, 
+                            float = code == 3)
+            elif chunkId == b'data':
+                if 'bits' not in info:
+                    raise ValueError('{} has no fmt chunk before its data'
+                                     .format(filename))
+                info['offset'] = file.tell()
+                break
+            else:
+                file.seek(chunkSize + chunkSize % 2, 1) # chunks are padded
+    
+    fileSize = os.path.getsize(filename)
+    if chunkSize in (0, 0xFFFFFFFF) or info['offset'] + chunkSize > fileSize:
+        chunkSize = fileSize - info['offset'] # streamed or RF64 file
+    
+    info['nFrames'] = chunkSize//(info['channels']*info['bits']//8)
+    
+    return info
+
+
+def _wav_dtype(info):
+    
+    """
+    Returns the numpy type of one sample of a .wav file. 24-bit samples are 
+    read as 3 bytes each.
+    """
+    
+    width = info['bits']//8
+    
+    if width == 3:
+        return np.uint8
+    if info['float']:
+        return '<f{}'.format(width)
+    if width == 1:
+        return np.uint8 # 8-bit .wav files are unsigned
+    
+    return '<i{}'.format(width)
+
+
+def _check_channel(info, channel):
+    
+    """
+    Raises a ValueError if the file described by info has no such channel.
+    """
+    
+    if not 0 <= channel < info['channels']:
+        raise ValueError('channel {} is out of range for {} channel audio'
+                         .format(channel, info['channels']))
+
+
+def _wav_frames(filename, info):
+    
+    """
+    Memory-maps the audio data of a .wav file as an (nFrames, channels) array,
+    or for 24-bit audio as an (nFrames, channels, 3) array of bytes.
+    """
+    
+    shape = (info['nFrames'], info['channels'])
+    if info['bits'] == 24:
+        shape += (3,)
+    
+    return np.memmap(filename, dtype = _wav_dtype(info), mode = 'r', 
+                     offset = info['offset'], shape = shape)
+
+
+def _channel_samples(frames, info, channel):
+    
+    """
+    Copies one channel out of a block of frames from _wav_frames, decoding 
+    24-bit samples to int32 and centring the unsigned 8-bit samples on 0 as 
+    int16.
+    """
+    
+    block = frames[:,channel]
+    
+    if info['bits'] == 24:
+        # assemble the little-endian bytes into the top of an int32, then 
+        # shift back down to keep the sign
+        return (block[:,0].astype(np.int32) << 8 
+                | block[:,1].astype(np.int32) << 16 
+                | block[:,2].astype(np.int32) << 24) >> 8
+    
+    if info['bits'] == 8: # silence is 128
+        return block.astype(np.int16) - 128
+    
+    return np.array(block)
+
+
+def open_wav(filename, channel = 0):
+    
+    """
+    Opens one channel of a .wav file as a memory map, so no audio is read 
+    until it is used and the channel is selected without copying.
+    
+    24-bit audio has no matching numpy type, and 8-bit audio is unsigned with
+    silence at 128, so neither can be used as mapped; use read_wav_blocks, 
+    which decodes them, instead.
+    
+    Parameters:
+        filename (str): the .wav file
+        
+        channel (int): the channel to read
+        
+    Returns:
+        rate (int): the sampling rate
+        
+        sound (array): read-only view of the samples of the channel
+    """
+    
+    info = wav_info(filename)
+    if info['bits'] in (8, 24):
+        raise ValueError('{}-bit audio can only be read with read_wav_blocks'
+                         .format(info['bits']))
+    _check_channel(info, channel)
+    
+    return info['rate'], _wav_frames(filename, info)[:,channel]
+
+
+def read_wav_blocks(filename, blockSize = 2**20, channel = 0, start = 0, 
+                    stop = None):
+    
+    """
+    Reads one channel of a .wav file in blocks of a fixed number of samples, 
+    so recordings of any length can be processed in bounded memory. 24-bit 
+    samples are returned as int32, and 8-bit samples as int16 centred on 0.
+    
+    Parameters:
+        filename (str): the .wav file
+        
+        blockSize (int): number of samples in each block
+        
+        channel (int): the channel to read
+        
+        start (int): the first sample to read
+        
+        stop (int): one past the last sample to read, defaults to the end of 
+        the file
+        
+    Yields:
+        block (array): the next blockSize samples. The last block may be 
+        shorter
+    """
+    
+    info = wav_info(filename)
+    _check_channel(info, channel)
+    frames = _wav_frames(filename, info)
+    stop = info['nFrames'] if stop is None else min(stop, info['nFrames'])
+    
+    for i in range(start, stop, blockSize):
+        yield _channel_samples(frames[i:min(i + blockSize, stop)], info, 
+                               channel)
+
+
+def detect_bounces(sound, rate, minSeparation = 0.01, envelopeWindow = 0.002,
+                   floorWindow = 0.2, floorRatio = 4, minHeight = 0.01, 
+                   holdoff = 0.05, holdoffRatio = 0.5, loudest = None):
+    
+    """
+    Finds the sample index of every bounce in one vectorized pass.
+    
+    The signal is rectified and its envelope is the moving maximum over 
+    envelopeWindow. A peak of the rectified signal is a bounce if it is higher
+    than all of:
+        - floorRatio times the background noise, the moving minimum of the 
+        envelope over floorWindow
+        - minHeight times the loudest sample in the recording, or loudest if
+        it is given
+        - holdoffRatio times the loudest sample in the holdoff seconds before 
+        it, so the ringing after a bounce is not counted as more bounces
+    Of peaks closer together than minSeparation, only the highest is kept. 
+    All filters are O(n), so a missed bounce has no effect on the others.
+    
+    Parameters:
+        sound (array): the samples of one channel
+        
+        rate (int): the sampling rate
+        
+        minSeparation (float): the shortest time between bounces, in seconds
+        
+        envelopeWindow (float): width of the moving maximum, in seconds
+        
+        floorWindow (float): width of the moving minimum, in seconds
+        
+        floorRatio (float): how far above the background a bounce must be
+        
+        minHeight (float): the smallest bounce, as a fraction of the loudest
+        
+        holdoff (float): how long the ringing of a bounce lasts, in seconds
+        
+        holdoffRatio (float): how loud a bounce must be compared to the 
+        ringing before it
+        
+        loudest (float): the level minHeight is relative to, for when sound 
+        is only part of a recording
+        
+    Returns:
+        bounceTimes (array[int]): the sample index of each bounce
+    """
+    
+    rect = np.abs(np.asarray(sound, dtype = float))
+    if len(rect) == 0:
+        return np.array([], dtype = int)
+    
+    def seconds(t):
+        return max(1, int(t*rate))
+    
+    envelope = maximum_filter1d(rect, seconds(envelopeWindow))
+    noise = minimum_filter1d(envelope, seconds(floorWindow))
+    
+    # loudest sample in the holdoff window ending just before each sample
+    size = 2*(seconds(holdoff)//2) + 1
+    recent = np.zeros(len(rect))
+    recent[1:] = maximum_filter1d(rect, size, origin = size//2)[:-1]
+    
+    threshold = np.maximum(floorRatio*noise, holdoffRatio*recent)
+    if loudest is None:
+        loudest = envelope.max()
+    threshold = np.maximum(threshold, minHeight*loudest)
+    
+    bounceTimes, properties = find_peaks(rect, height = threshold, 
+                                         distance = seconds(minSeparation))
+    
+    return bounceTimes
+
+
+@functools.lru_cache(maxsize = 8)
+def _hann_window(size):
+    
+    """
+    Returns a read-only Hann window of the given size, computed once per size.
+    """
+    
+    window = np.hanning(size)
+    window.flags.writeable = False
+    
+    return window
+
 
+def bounce_frequencies(sound, rate, bounceTimes, windowSize = 2048, lead = 0):
+    
+    """
+    Finds the dominant ringing frequency of every bounce at once. A window of
+    windowSize samples starting lead samples before each bounce is cut out, 
+    tapered with a Hann window, and all windows are transformed together as 
+    one 2D real FFT. No figure is drawn.
+    
+    The Hann windows are cached by size, and numpy reuses its FFT plan for
+    every row of the batch. Windows that run past either end of the 
+    recording are padded with zeros.
+    
+    Parameters:
+        sound (array): the samples of one channel
+        
+        rate (int): the sampling rate
+        
+        bounceTimes (array[int]): the sample index of each bounce
+        
+        windowSize (int): number of samples analysed per bounce
+        
+        lead (int): number of samples before each bounce to start the window
+        
+    Returns:
+        frequencies (array[float]): the frequency with the most power, in Hz,
+        for each bounce
+    """
+    
+    bounceTimes = np.asarray(bounceTimes, dtype = int)
+    index = bounceTimes[:,None] - lead + np.arange(windowSize)
+    inside = (index >= 0) & (index < len(sound))
+    
+    frames = np.where(inside, sound[np.clip(index, 0, len(sound) - 1)], 0)
+    frames = frames*_hann_window(windowSize)
+    
+    power = np.abs(np.fft.rfft(frames, axis = 1))**2
+    power[:,0] = 0 # ignore the constant offset
+    freqs = np.fft.rfftfreq(windowSize, 1/rate)
+    
+    return freqs[np.argmax(power, axis = 1)]
 
-# Import the ping pong sound data
-rate, data = wavfile.read('pingpong.wav') # rate is the sampling rate: 44100
 
-sound = data[:315000,0]
-npts = len(sound)
-time = np.arange(npts)/rate # convert to time points (seconds)
+def waveform_envelope(sound, rate, nBins):
+    
+    """
+    Reduces a waveform to the lowest and highest sample in each of nBins 
+    equal stretches of time, which is all that can be seen of it when each 
+    stretch is one pixel wide.
+    
+    Parameters:
+        sound (array): the sound data
+        
+        rate (int): the sampling rate
+        
+        nBins (int): number of stretches, usually the plot width in pixels
+        
+    Returns:
+        binTimes (array): start time of each stretch in seconds
+        
+        low (array): lowest sample in each stretch
+        
+        high (array): highest sample in each stretch
+    """
+    
+    binSize = max(1, -(-len(sound)//nBins)) # round up
+    nFull = len(sound)//binSize
+    
+    full = sound[:nFull*binSize].reshape(nFull, binSize)
+    low = full.min(axis = 1)
+    high = full.max(axis = 1)
+    
+    if nFull*binSize < len(sound): # the last, shorter stretch
+        rest = sound[nFull*binSize:]
+        low = np.append(low, rest.min())
+        high = np.append(high, rest.max())
+    
+    binTimes = np.arange(len(low))*binSize/rate
+    
+    return binTimes, low, high
 
 
-# Plot the sound amplitude vs time
-plt.figure(figsize = (7, 5))
-plt.plot(time, sound, color = 'darkgreen')
+def plot_waveform(sound, rate, bounceTimes = None, color = 'darkblue', 
+                  markerColor = 'greenyellow', ax = None):
+    
+    """
+    Plots a waveform of any length at the cost of the plot width rather than 
+    the number of samples, by drawing its min/max envelope at one stretch per
+    pixel. Bounce markers are drawn as a single collection of lines.
+    
+    Parameters:
+        sound (array): the sound data
+        
+        rate (int): the sampling rate
+        
+        bounceTimes (array): sample index of each bounce to mark
+        
+        color (str): colour of the waveform
+        
+        markerColor (str): colour of the bounce markers
+        
+        ax (Axes): the axes to draw on, the current axes by default
+        
+    Returns:
+        ax (Axes): the axes drawn on
+    """
+    
+    if ax is None:
+        ax = plt.gca()
+    
+    nPixels = int(ax.get_window_extent().width)
+    
+    if len(sound) <= 2*nPixels: # few enough samples to draw them all
+        ax.plot(np.arange(len(sound))/rate, sound, color = color)
+    else:
+        binTimes, low, high = waveform_envelope(sound, rate, nPixels)
+        ax.fill_between(binTimes, low, high, step = 'post', color = color, 
+                        linewidth = 0.5, edgecolor = color)
+        ax.set_xlim(0, len(sound)/rate)
+    
+    if bounceTimes is not None:
+        # x in seconds and y spanning the axes, like axvline
+        ax.vlines(np.asarray(bounceTimes)/rate, 0, 1, color = markerColor, 
+                  transform = ax.get_xaxis_transform())
+    
+    return ax
 
-plt.title('Sound Amplitude vs. Time', fontsize = 16)
-plt.xlabel('Time (s)', fontsize = 14)
-plt.ylabel('Amplitude', fontsize = 14)
 
-ax1 = plt.gca()
-ax1.get_yaxis().set_major_formatter(
-    mpl.ticker.FuncFormatter(lambda x, p: format(int(x), ',')))
+def _robust_line(x, y, robust):
+    
+    """
+    Fits the line y = w0 + w1*x with the Theil-Sen estimator (the median of 
+    the slopes between every pair of points) or with Huber's M-estimator 
+    (iteratively reweighted least squares), which both ignore a few outliers.
+    """
+    
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    
+    if robust == 'theil-sen':
+        i, j = np.triu_indices(len(x), 1)
+        w1 = np.median((y[j] - y[i])/(x[j] - x[i]))
+        w0 = np.median(y - w1*x)
+        
+        return w0, w1
+    
+    if robust != 'huber':
+        raise ValueError("robust must be None, 'theil-sen' or 'huber'")
+    
+    A = np.column_stack([np.ones(len(x)), x])
+    weights = np.ones(len(x))
+    for i in range(20):
+        sw = np.sqrt(weights)
+        (w0, w1), *rest = np.linalg.lstsq(A*sw[:,None], y*sw, rcond = None)
+        residual = np.abs(y - w0 - w1*x)
+        scale = 1.4826*np.median(residual) # robust standard deviation
+        if scale == 0:
+            break
+        weights = np.minimum(1, 1.345*scale/np.maximum(residual, 1e-300))
+    
+    return w0, w1
 
 
-# Find, extract, and indicate the times of each bounce
-t0 = np.argmax(sound) # index of max value
+def fit_decay(bounceTimes, robust = None):
+    
+    """
+    Fits the model t(i+1) = r*t(i) to the intervals between bounces by a least
+    squares regression of log(interval) on the bounce number.
+    
+    Parameters:
+        bounceTimes (array[int]): the sample index of each bounce
+        
+        robust (str): None for ordinary least squares, or 'theil-sen' or 
+        'huber' for a robust fit that ignores intervals broken by missed or 
+        double-detected bounces
+        
+    Returns:
+        w0 (float): the intercept, the log of the first interval
+        
+        w1 (float): the slope, log(r)
+    """
+    
+    bounceTimes = np.array(bounceTimes, dtype = int)
+    interval = bounceTimes[1:] - bounceTimes[:-1]
+    nBounces = np.arange(len(interval)) # number of bounces
+    logInterval = np.log(interval)
+    
+    if robust is not None:
+        return _robust_line(nBounces, logInterval, robust)
+    
+    # Compute the variables in the regression equation
+    xbar = np.mean(nBounces)
+    ybar = np.mean(logInterval)
+    x2bar = np.mean(nBounces**2)
+    xybar = np.mean(nBounces*logInterval)
+    
+    a = np.array([[1, xbar], [xbar, x2bar]])
+    b = np.array([ybar, xybar])
+    w0, w1 = np.linalg.solve(a, b)
+    
+    return w0, w1
 
-wait = 7000 # set an arbitrary wait time, half the distance to t1
-tmax = 305000
-bounceTimes = [t0]
 
-while t0 < tmax:
-    # define an arbitrary window to slice over
-    start = t0 + wait
-    end = t0 + wait*3
+def decay_fit_start(robust = None):
     
-    relative = np.argmax(sound[start:end])
-    t1 = relative + start # get the actual index of bounce
-    bounceTimes.append(t1)
+    """
+    Starts a running fit of the bounce decay, for updating r as each bounce 
+    is detected with decay_fit_update.
     
-    wait = int((t1-t0)/2)
-    t0 = t1
+    Parameters:
+        robust (str): None for ordinary least squares, or 'theil-sen' or 
+        'huber', as in fit_decay
+        
+    Returns:
+        state (dict): the state of the fit. state['r'] holds the current 
+        estimate of r, nan until three bounces have been added
+    """
+    
+    return {'robust': robust, 'last': None, 'n': 0, 'sums': np.zeros(5), 
+            'x': [], 'y': [], 'w0': np.nan, 'w1': np.nan, 'r': np.nan}
+
+
+def decay_fit_update(state, bounceTime):
+    
+    """
+    Adds one bounce to a running fit of the bounce decay and updates the 
+    estimate of r. The least squares fit is kept as running sums, so each 
+    update costs O(1); the robust fits are recomputed from the stored 
+    intervals.
+    
+    Parameters:
+        state (dict): the state from decay_fit_start, updated in place
+        
+        bounceTime (int): the sample index of the new bounce
+        
+    Returns:
+        r (float): the current estimate of r
+    """
+    
+    last = state['last']
+    state['last'] = bounceTime
+    if last is None:
+        return state['r']
+    
+    x = state['n']
+    y = np.log(bounceTime - last)
+    state['n'] += 1
+    state['sums'] += [1, x, y, x*x, x*y]
+    n, sx, sy, sxx, sxy = state['sums']
+    
+    if state['robust'] is not None:
+        state['x'].append(x)
+        state['y'].append(y)
+    
+    if n < 2:
+        return state['r']
+    
+    if state['robust'] is None:
+        w1 = (n*sxy - sx*sy)/(n*sxx - sx*sx)
+        w0 = (sy - w1*sx)/n
+    else:
+        w0, w1 = _robust_line(state['x'], state['y'], state['robust'])
+    
+    state['w0'] = w0
+    state['w1'] = w1
+    state['r'] = np.exp(w1)
+    
+    return state['r']
+
+
+def bounce_stream_start(rate, windowSize = 2048, robust = None, 
+                        minSeparation = 0.01, floorWindow = 0.2, 
+                        holdoff = 0.05, **detectArgs):
+    
+    """
+    Starts detecting bounces in audio that arrives block by block, using the
+    same onset detection and spectral analysis as the offline functions. 
+    Feed the blocks to bounce_stream_update and call bounce_stream_finish 
+    after the last one.
+    
+    The samples are kept in a ring buffer that holds just enough audio for 
+    the detection filters and the spectral window, so memory use doesn't 
+    grow with the length of the recording. A bounce is reported once no 
+    louder peak can still arrive within minSeparation of it and its spectral
+    window is complete, so events lag the audio by about 
+    max(minSeparation, floorWindow/2) + windowSize/rate seconds plus one block.
+    
+    Parameters:
+        rate (int): the sampling rate
+        
+        windowSize (int): number of samples analysed per bounce, as in 
+        bounce_frequencies, or None to skip the spectral analysis
+        
+        robust (str): the fit used to update r, as in decay_fit_start
+        
+        minSeparation, floorWindow, holdoff, **detectArgs: the settings of 
+        detect_bounces
+        
+    Returns:
+        state (dict): the ring buffer and the progress of the detection
+    """
+    
+    detectArgs.update(minSeparation = minSeparation, 
+                      floorWindow = floorWindow, holdoff = holdoff)
+    
+    return {'rate': rate, 'windowSize': windowSize, 'detectArgs': detectArgs,
+            'context': int(rate*max(floorWindow, holdoff)) + 1, # audio needed
+            'delay': int(rate*(max(minSeparation, floorWindow/2) + 0.01)), 
+            'minGap': int(rate*minSeparation), 
+            'ring': np.zeros(0), 
+            'pos': 0, # number of samples received
+            'done': 0, # samples before this have been searched for bounces
+            'lastBounce': -int(rate*minSeparation), 
+            'pending': [], # bounces waiting for their spectral window
+            'loudest': 0., 
+            'fit': decay_fit_start(robust)}
+
+
+def _ring_read(state, start, stop):
+    
+    """
+    Returns the samples start to stop from the ring buffer of a bounce 
+    stream.
+    """
+    
+    ring = state['ring']
+    
+    return ring[np.arange(start, stop) % len(ring)]
+
+
+def _bounce_stream_analyse(state, final):
+    
+    """
+    Searches the newly finalized audio of a bounce stream for bounces and 
+    returns the events of the bounces that are ready to report.
+    """
+    
+    rate, pos, done = state['rate'], state['pos'], state['done']
+    windowSize = state['windowSize']
+    
+    events = []
+    stop = pos if final else pos - state['delay']
+    
+    if stop > done:
+        segStart = max(0, done - state['context'])
+        peaks = detect_bounces(_ring_read(state, segStart, pos), rate, 
+                               loudest = state['loudest'], 
+                               **state['detectArgs']) + segStart
+        
+        for peak in peaks[(peaks >= done) & (peaks < stop)]:
+            if peak - state['lastBounce'] >= state['minGap']:
+                state['pending'].append(peak)
+                state['lastBounce'] = peak
+        state['done'] = stop
+    
+    pending = state['pending']
+    if windowSize is None:
+        ready = pending
+    else:
+        ready = [peak for peak in pending 
+                 if final or peak + windowSize <= pos]
+    
+    if ready:
+        if windowSize is None:
+            frequencies = np.full(len(ready), np.nan)
+        else:
+            segment = _ring_read(state, ready[0], 
+                                 min(pos, ready[-1] + windowSize))
+            frequencies = bounce_frequencies(segment, rate, 
+                                             np.array(ready) - ready[0], 
+                                             windowSize)
+        
+        ring = state['ring']
+        for peak, frequency in zip(ready, frequencies):
+            events.append({'index': int(peak), 'time': peak/rate, 
+                           'amplitude': ring[peak % len(ring)], 
+                           'frequency': frequency, 
+                           'r': decay_fit_update(state['fit'], peak), 
+                           'latency': (pos - peak)/rate})
+        state['pending'] = pending[len(ready):]
+    
+    return events
+
+
+def bounce_stream_update(state, block):
+    
+    """
+    Adds a block of samples to a bounce stream from bounce_stream_start.
+    
+    Parameters:
+        state (dict): the bounce stream
+        
+        block (array): the samples that follow the previous block
+        
+    Returns:
+        events (list[dict]): for each bounce that is ready to report, its 
+        sample index ('index'), time in seconds ('time'), amplitude 
+        ('amplitude'), dominant ringing frequency ('frequency'), the estimate
+        of r so far ('r') and how long after the bounce it was reported, in 
+        seconds of audio ('latency')
+    """
+    
+    block = np.asarray(block, dtype = float)
+    pos = state['pos']
+    
+    # the ring must hold everything from the oldest sample still needed to 
+    # the end of the new block
+    needed = (state['context'] + state['delay'] + (state['windowSize'] or 0)
+              + 2*len(block))
+    if needed > len(state['ring']):
+        size = 2**int(np.ceil(np.log2(needed)))
+        keep = min(pos, len(state['ring']))
+        ring = np.zeros(size)
+        ring[np.arange(pos - keep, pos) % size] = _ring_read(state, 
+                                                             pos - keep, pos)
+        state['ring'] = ring
+    
+    ring = state['ring']
+    ring[np.arange(pos, pos + len(block)) % len(ring)] = block
+    state['pos'] = pos + len(block)
+    if len(block):
+        state['loudest'] = max(state['loudest'], np.abs(block).max())
+    
+    return _bounce_stream_analyse(state, final = False)
+
+
+def bounce_stream_finish(state):
+    
+    """
+    Reports the remaining bounces of a bounce stream once all of its blocks 
+    have been added, in the same form as bounce_stream_update.
+    """
+    
+    return _bounce_stream_analyse(state, final = True)
+
+
+def analyze_recording(filename, channel = 0, blockSize = 2**18, 
+                      windowSize = 2048):
+    
+    """
+    Runs the whole bounce analysis on one recording: loading, onset 
+    detection, the interval regression and the spectral analysis. The 
+    recording is read and searched one block at a time, so recordings of any
+    length can be analysed in a fixed amount of memory.
+    
+    Parameters:
+        filename (str): the .wav file
+        
+        channel (int): the channel to analyse
+        
+        blockSize (int): number of samples read at a time
+        
+        windowSize (int): number of samples analysed per bounce, as in 
+        bounce_frequencies
+        
+    Returns:
+        results (dict): the file name, the value of r, the number of bounces,
+        the median dominant ringing frequency, the time taken by each stage 
+        in seconds, and an error message if the file couldn't be read or 
+        analysed
+    """
+    
+    results = {'file': os.path.basename(filename), 'r': np.nan, 
+               'nBounces': 0, 'frequency': np.nan, 'error': ''}
+    
+    try:
+        info = wav_info(filename)
+        rate = info['rate']
+        blocks = read_wav_blocks(filename, blockSize, channel)
+        stream = bounce_stream_start(rate, windowSize = None)
+        
+        # read and search the recording block by block, so memory use 
+        # doesn't grow with its length
+        bounceTimes = []
+        results['loadTime'] = results['onsetTime'] = 0.
+        while True:
+            start = perf_counter()
+            block = next(blocks, None)
+            results['loadTime'] += perf_counter() - start
+            
+            start = perf_counter()
+            if block is None:
+                events = bounce_stream_finish(stream)
+            else:
+                events = bounce_stream_update(stream, block)
+            bounceTimes.extend(event['index'] for event in events)
+            results['onsetTime'] += perf_counter() - start
+            
+            if block is None:
+                break
+        
+        bounceTimes = np.array(bounceTimes, dtype = int)
+        results['nBounces'] = len(bounceTimes)
+        
+        if len(bounceTimes) < 3: # fewer than two intervals to fit
+            results['error'] = 'too few bounces'
+            return results
+        
+        start = perf_counter()
+        w0, w1 = fit_decay(bounceTimes)
+        results['r'] = np.exp(w1)
+        results['regressionTime'] = perf_counter() - start
+        
+        # read just the window after each bounce, from a single map of the 
+        # file
+        start = perf_counter()
+        frames = _wav_frames(filename, info)
+        windows = np.zeros((len(bounceTimes), windowSize))
+        for window, bounce in zip(windows, bounceTimes):
+            samples = _channel_samples(frames[bounce:bounce + windowSize], 
+                                       info, channel)
+            window[:len(samples)] = samples
+        
+        frequencies = bounce_frequencies(windows.ravel(), rate, 
+                                         np.arange(len(windows))*windowSize, 
+                                         windowSize)
+        results['frequency'] = np.median(frequencies)
+        results['spectralTime'] = perf_counter() - start
+    except (OSError, ValueError, np.linalg.LinAlgError) as error:
+        results['error'] = str(error)
+    
+    return results
+
+
+def analyze_directory(directory, outFile = 'bounce_results.csv', 
+                      channel = 0, nWorkers = None):
+    
+    """
+    Analyses every .wav file in a directory with analyze_recording, spreading
+    the files over a pool of worker processes, and writes one row per file to 
+    a .csv table.
+    
+    Parameters:
+        directory (str): the directory containing the .wav files
+        
+        outFile (str): the .csv file to write the results to
+        
+        channel (int): the channel to analyse
+        
+        nWorkers (int): number of worker processes, defaults to the number of
+        CPUs
+        
+    Returns:
+        results (list[dict]): the results of analyze_recording for every file,
+        sorted by file name
+    """
+    
+    files = sorted(glob.glob(os.path.join(directory, '*.wav')))
+    
+    with multiprocessing.Pool(nWorkers) as pool:
+        results = pool.map(functools.partial(analyze_recording, 
+                                             channel = channel), files)
+    
+    fields = ['file', 'r', 'nBounces', 'frequency', 'loadTime', 'onsetTime',
+              'regressionTime', 'spectralTime', 'error']
+    with open(outFile, 'w', newline = '') as file:
+        writer = csv.DictWriter(file, fields)
+        writer.writeheader()
+        writer.writerows(results)
+    
+    return results
+
+
+async def tail_wav_blocks(filename, blockSize = 4096, channel = 0, 
+                          poll = 0.05, idleTimeout = 2.0):
+    
+    """
+    Reads one channel of a .wav file that is still being recorded, waiting 
+    for new audio to be appended to it. Stops once no new audio has arrived 
+    for idleTimeout seconds.
+    
+    Parameters:
+        filename (str): the .wav file
+        
+        blockSize (int): the largest number of samples in each block
+        
+        channel (int): the channel to read
+        
+        poll (float): how often to check the file for new audio, in seconds
+        
+        idleTimeout (float): how long to wait for new audio, in seconds
+        
+    Yields:
+        block (array): the samples that have arrived since the last block
+    """
+    
+    idle = 0.
+    while True:
+        try:
+            info = wav_info(filename)
+            break
+        except (OSError, ValueError): # the header hasn't been written yet
+            if idle >= idleTimeout:
+                raise
+            await asyncio.sleep(poll)
+            idle += poll
+    
+    _check_channel(info, channel)
+    frameShape = (info['channels'],) + ((3,) if info['bits'] == 24 else ())
+    frameBytes = info['channels']*info['bits']//8
+    buffer = b''
+    idle = 0.
+    
+    with open(filename, 'rb') as file:
+        file.seek(info['offset'])
+        
+        while idle < idleTimeout:
+            buffer += file.read(blockSize*frameBytes - len(buffer))
+            nBytes = len(buffer) - len(buffer) % frameBytes
+            
+            if nBytes == 0:
+                await asyncio.sleep(poll)
+                idle += poll
+                continue
+            
+            frames = np.frombuffer(buffer[:nBytes], dtype = _wav_dtype(info))
+            buffer = buffer[nBytes:]
+            idle = 0.
+            
+            yield _channel_samples(frames.reshape((-1,) + frameShape), info, 
+                                   channel)
+
+
+async def reader_blocks(reader, dtype = '<i2', channels = 1, channel = 0, 
+                        blockSize = 4096):
+    
+    """
+    Reads one channel of raw interleaved samples from an asyncio stream, such
+    as the reader from asyncio.open_connection for a socket or a pipe fed by 
+    a microphone.
+    
+    Parameters:
+        reader (asyncio.StreamReader): the stream of samples
+        
+        dtype (str): the numpy type of each sample
+        
+        channels (int): number of interleaved channels
+        
+        channel (int): the channel to read
+        
+        blockSize (int): the largest number of samples in each block
+        
+    Yields:
+        block (array): the samples that have arrived since the last block
+    """
+    
+    frameBytes = np.dtype(dtype).itemsize*channels
+    buffer = b''
+    
+    while True:
+        data = await reader.read(blockSize*frameBytes - len(buffer))
+        if not data:
+            break
+        
+        buffer += data
+        nBytes = len(buffer) - len(buffer) % frameBytes
+        if nBytes:
+            frames = np.frombuffer(buffer[:nBytes], dtype = dtype)
+            buffer = buffer[nBytes:]
+            
+            yield np.array(frames.reshape(-1, channels)[:,channel])
+
+
+async def stream_bounces(blocks, rate, windowSize = 2048, robust = None, 
+                         **detectArgs):
+    
+    """
+    Detects bounces in a live audio stream as the blocks arrive, with 
+    bounce_stream_update.
+    
+    Parameters:
+        blocks (async iterable): blocks of samples, for example from 
+        tail_wav_blocks or reader_blocks
+        
+        rate (int): the sampling rate
+        
+        windowSize (int): number of samples analysed per bounce, as in 
+        bounce_frequencies
+        
+        robust (str): the fit used to update r, as in decay_fit_start
+        
+        **detectArgs: the settings of detect_bounces
+        
+    Yields:
+        event (dict): for each bounce, the event from bounce_stream_update
+    """
+    
+    state = bounce_stream_start(rate, windowSize, robust, **detectArgs)
+    
+    async for block in blocks:
+        for event in bounce_stream_update(state, block):
+            yield event
+    
+    for event in bounce_stream_finish(state):
+        yield event
+
+
+if __name__ == '__main__':
+    # Import the ping pong sound data
+    rate, sound = open_wav('pingpong.wav', channel = 0) # rate is the sampling rate: 44100
+
+    sound = sound[:315000]
+
+
+    # Plot the sound amplitude vs time
+    plt.figure(figsize = (7, 5))
+    plot_waveform(sound, rate, color = 'darkgreen')
+
+    plt.title('Sound Amplitude vs. Time', fontsize = 16)
+    plt.xlabel('Time (s)', fontsize = 14)
+    plt.ylabel('Amplitude', fontsize = 14)
+
+    ax1 = plt.gca()
+    ax1.get_yaxis().set_major_formatter(
+        mpl.ticker.FuncFormatter(lambda x, p: format(int(x), ',')))
+
+
+    # Find, extract, and indicate the times of each bounce
+    bounceTimes = detect_bounces(sound, rate)
+
+    # Plot the bounce times over the original sound data
+    plt.figure(figsize = (7, 5))
+    plot_waveform(sound, rate, bounceTimes) # bounce times as vertical lines
+
+    plt.title('Plotting Bounce Times', fontsize = 16)
+    plt.xlabel('Time (s)', fontsize = 14)
+    plt.ylabel('Amplitude', fontsize = 14)
+
+    ax2 = plt.gca()
+    ax2.get_yaxis().set_major_formatter(
+        mpl.ticker.FuncFormatter(lambda x, p: format(int(x), ',')))
+
+
+    # Calculate the least squares regression line to find the value of r
+    bounceTimes = np.array(bounceTimes, dtype = int)
+    interval = bounceTimes[1:] - bounceTimes[:-1] # 72 intervals
+    nBounces = np.arange(len(interval)) # number of bounces
+
+    w0, w1 = fit_decay(bounceTimes)
 
-# Plot the bounce times over the original sound data
-plt.figure(figsize = (7, 5))
-plt.plot(time, sound, color = 'darkblue')
+    r = np.exp(w1)
+    ti = (r**nBounces)*np.exp(w0) # time of ith bounce
 
-for i in time[bounceTimes]: # bounce times as vertical lines
-    plt.axvline(i, color = 'greenyellow')
+    # Plot the regression with the original data
+    plt.figure(figsize = (7, 5))
+    plt.semilogy(nBounces, interval, color = 'blue', label = 'Original Data')
+    plt.semilogy(nBounces, ti, color = 'deeppink', label = 'Linear Regression')
 
-plt.title('Plotting Bounce Times', fontsize = 16)
-plt.xlabel('Time (s)', fontsize = 14)
-plt.ylabel('Amplitude', fontsize = 14)
+    plt.title('Original Data and Linear Regression', fontsize = 16)
+    plt.xlabel('Number of Bounces', fontsize = 14)
+    plt.ylabel('log($t_i$), log(interval)', fontsize = 14)
 
-ax2 = plt.gca()
-ax2.get_yaxis().set_major_formatter(
-    mpl.ticker.FuncFormatter(lambda x, p: format(int(x), ',')))
+    plt.legend()
 
+    print('The fixed fraction of energy lost on each bounce is: {:.2f}'.format(r))
 
-# Calculate the least squares regression line to find the value of r
-bounceTimes = np.array(bounceTimes, dtype = int)
-interval = bounceTimes[1:] - bounceTimes[:-1] # 72 intervals
-nBounces = np.arange(len(interval)) # number of bounces
-logInterval = np.log(interval)
 
-# Compute the variables in the regression equation
-xbar = np.mean(nBounces)
-ybar = np.mean(logInterval)
-x2bar = np.mean(nBounces**2)
-xybar = np.mean(nBounces*logInterval)
+    # Plot the amplitude vs time for one bounce
+    singleBounce = sound[39400:41500]
+    timePts = np.arange(len(singleBounce))/rate
 
-a = np.array([[1, xbar], [xbar, x2bar]])
-b = np.array([ybar, xybar])
-w0, w1 = np.linalg.solve(a, b)
+    plt.figure(figsize = (14, 7))
+    plt.plot(timePts, singleBounce, color = 'purple')
 
-r = np.exp(w1)
-ti = (r**nBounces)*np.exp(w0) # time of ith bounce
+    plt.title('Sound Amplitude vs. Time for One Bounce', fontsize = 16)
+    plt.xlabel('Time (s)', fontsize = 14)
+    plt.ylabel('Amplitude', fontsize = 14)
 
-# Plot the regression with the original data
-plt.figure(figsize = (7, 5))
-plt.semilogy(nBounces, interval, color = 'blue', label = 'Original Data')
-plt.semilogy(nBounces, ti, color = 'deeppink', label = 'Linear Regression')
+    ax3 = plt.gca()
+    ax3.get_yaxis().set_major_formatter(
+        mpl.ticker.FuncFormatter(lambda x, p: format(int(x), ',')))
 
-plt.title('Original Data and Linear Regression', fontsize = 16)
-plt.xlabel('Number of Bounces', fontsize = 14)
-plt.ylabel('log($t_i$), log(interval)', fontsize = 14)
+    # Find the dominant frequency of this bounce
+    plt.figure()
+    bouncePSD = plt.psd(singleBounce, Fs = 44100) # power spectral density
 
-plt.legend()
+    maxAmp = np.argmax(bouncePSD[0])
+    maxFrequency = bouncePSD[1][maxAmp]
 
-print('The fixed fraction of energy lost on each bounce is: {:.2f}'.format(r))
+    print('The dominant ringing frequency is: {:,.0f}'.format(maxFrequency))
 
 
-# Plot the amplitude vs time for one bounce
-singleBounce = data[39400:41500,0]
-timePts = np.arange(len(singleBounce))/rate
+    # Find the dominant frequency of every bounce
+    frequencies = bounce_frequencies(sound, rate, bounceTimes)
 
-plt.figure(figsize = (14, 7))
-plt.plot(timePts, singleBounce, color = 'purple')
+    plt.figure(figsize = (7, 5))
+    plt.plot(np.arange(len(frequencies)), frequencies, 'o', color = 'purple')
 
-plt.title('Sound Amplitude vs. Time for One Bounce', fontsize = 16)
-plt.xlabel('Time (s)', fontsize = 14)
-plt.ylabel('Amplitude', fontsize = 14)
+    plt.title('Dominant Ringing Frequency of Each Bounce', fontsize = 16)
+    plt.xlabel('Number of Bounces', fontsize = 14)
+    plt.ylabel('Frequency (Hz)', fontsize = 14)
 
-ax3 = plt.gca()
-ax3.get_yaxis().set_major_formatter(
-    mpl.ticker.FuncFormatter(lambda x, p: format(int(x), ',')))
 
-# Find the dominant frequency of this bounce
-plt.figure()
-bouncePSD = plt.psd(singleBounce, Fs = 44100) # power spectral density
+    # Analyse a whole directory of recordings
+    """
+    NOTE: analyze_directory uses every CPU core and writes one row per .wav 
+    file to bounce_results.csv
+    """
+    # results = analyze_directory('recordings')
 
-maxAmp = np.argmax(bouncePSD[0])
-maxFrequency = bouncePSD[1][maxAmp]
 
-print('The dominant ringing frequency is: {:,.0f}'.format(maxFrequency))
+    # Report bounces live while a recording is being made
+    """
+    NOTE: tail_wav_blocks follows a .wav file as it is written. For a 
+    microphone, feed its samples to a socket or pipe and use reader_blocks on 
+    the reader from asyncio.open_connection instead.
+    """
+    # async def print_bounces(filename):
+    #     rate = wav_info(filename)['rate']
+    #     async for event in stream_bounces(tail_wav_blocks(filename), rate):
+    #         print('Bounce at {time:.3f} s, {frequency:,.0f} Hz, '
+    #               'r = {r:.2f}'.format(**event))
+    # 
+    # asyncio.run(print_bounces('live.wav'))
@@ -10,6 +10,10 @@ then the current position.
 Stumbledown Reducing Algorithm: consists of keeping track of the number of 
 failed steps and reducing the stepsize after a set number of failures.
 
+Levenberg-Marquardt Algorithm: uses the slope of each mismatch (the Jacobian)
+to step straight towards the minimum of the sum of squared mismatches, 
+blending in a small gradient descent step whenever a full step fails.
+
 The 2D GPS Problem:
     1) The calculated distance of a location (x, y) from a satellite, i, is 
     
@@ -28,14 +32,34 @@ The 2D GPS Problem:
     
     Finding this unknown location (x, y) can now be considered an optimization 
     problem where the error is minimized.
+
+The 3D Pseudorange Problem:
+    Real receivers time the signals with a clock that is off by an unknown 
+    amount, which adds the same distance, the clock bias b, to every measured
+    distance (pseudorange):
+    
+    pseudorange_i = sqrt((x - x_i)^2 + (y - y_i)^2 + (z - z_i)^2) + b
+    
+    so (x, y, z, b) is found from at least 4 satellites. How much the 
+    satellite geometry magnifies measurement errors is given by the dilution 
+    of precision (DOP).
 """
 
 
+import functools
+import weakref
+
 import numpy as np
+import matplotlib as mpl
 import matplotlib.pyplot as plt
 from numpy.random import rand
 
 
+SATELLITES = np.array([[567, 390.7, 366.9], [73.2, 499.5, 444.9], 
+                       [204, 501, 386], [337.3, 609.3, 480.5], 
+                       [368.5, 116.3, 57.0]]) #[x,y,d]
+
+
 # Stumbledown Algorithm Exercise
 def testf(x, y):
     
@@ -79,21 +103,55 @@ def stumbledown(f, p, stepSize, nSteps):
     """
     
     points  = np.empty((nSteps, 4))
-    points[0] = [*p, f(*p), True]
+    fp = f(*p) # value at the current point, kept instead of recalculated
+    points[0] = [*p, fp, True]
     
     
     for i in range(1, nSteps):
         step = rand(2)*2*stepSize - stepSize
         q = p + step
-        if f(*q) < f(*p):
-            p = q
-            points[i] = [*p, f(*p), True]
+        fq = f(*q)
+        if fq < fp:
+            p, fp = q, fq
+            points[i] = [*p, fp, True]
         else:
-            points[i] = [*p, f(*p), False]
+            points[i] = [*p, fp, False]
     
     return points
 
 
+def format_stumbledown(points, steps = None):
+    
+    """
+    Formats the points of a stumbledown run as a table, with a single 
+    formatting operation for all of the rows, so that it can be printed with 
+    a single write.
+    
+    Parameters:
+        points (array[float]): the points returned by one of the stumbledown
+        functions
+        
+        steps (array[int]): the step number of each point, if only some steps
+        were recorded
+        
+    Returns:
+        table (str): the heading and one line per point
+    """
+    
+    if steps is None:
+        steps = np.arange(len(points))
+    
+    columns = np.empty((len(points), 5), dtype = object)
+    columns[:,0] = steps
+    columns[:,1] = np.where(points[:,3] == True, 'Yes', '   ')
+    columns[:,2:] = points[:,:3]
+    
+    heading = "{:8}{:12}{:11}{:10}{}".format("Steps","Success","x","y","f(x,y)")
+    rows = ("\n%2d%11s%11.3f%11.3f%13.3f"*len(points)) % tuple(columns.ravel())
+    
+    return heading + "\n________________________________________________" + rows
+
+
 def print_stumbledown(f, p, stepSize, nSteps):
     
     """
@@ -113,23 +171,14 @@ def print_stumbledown(f, p, stepSize, nSteps):
         none
     """
     
-    print("{:8}{:12}{:11}{:10}{}".format("Steps","Success","x","y","f(x,y)"))
-    print("________________________________________________")
-    
     info = stumbledown(f, p, stepSize, nSteps)
     
-    for i in range(nSteps):
-        if info[i, 3] == True:
-            success = 'Yes'
-        else:
-            success = '   '
-            
-        print("{:2}{:>11}{:11.3f}{:11.3f}{:13.3f}".format(i, success, 
-                                            info[i,0], info[i,1], info[i,2]))
+    print(format_stumbledown(info))
 
 
 # Stumbledown Reducing Algorithm Exercise
-def stumbledown_reducing(f, p, stepSize, nSteps):
+def stumbledown_reducing(f, p, stepSize, nSteps, every = 1, 
+                         acceptedOnly = False, returnSteps = False):
     
     """
     Implements the stumbledown reducing algorithm.
@@ -144,14 +193,36 @@ def stumbledown_reducing(f, p, stepSize, nSteps):
         
         nSteps (int): number of steps the algorithm will run through
         
+        every (int): only every this many steps are recorded, along with the 
+        first and last steps
+        
+        acceptedOnly (bool): only the first step and the steps that were 
+        better than the current point are recorded (every is ignored)
+        
+        returnSteps (bool): whether to also return the step number of each 
+        recorded point
+        
     Returns:
-        points (array[float]): contains all of the (x, y) points, the function
-        value of the points, and whether the new point was better than the 
-        current point (True if new < current, False if new > current)
+        points (array[float]): contains the recorded (x, y) points, the 
+        function value of the points, and whether the new point was better 
+        than the current point (True if new < current, False if new > current)
+        
+        steps (array[int]): the step number of each recorded point, if 
+        returnSteps is True
     """
     
-    points  = np.empty((nSteps, 4))
-    points[0] = [*p, f(*p), True]
+    if acceptedOnly: # the number of accepted steps isn't known in advance
+        size = min(nSteps, 1024)
+    else:
+        size = min(nSteps, (nSteps - 1)//every + 2)
+    
+    points = np.empty((size, 4))
+    steps = np.empty(size, dtype = int)
+    
+    fp = f(*p) # value at the current point, kept instead of recalculated
+    points[0] = [*p, fp, True]
+    steps[0] = 0
+    nRecorded = 1
     
     i = 1 # current step
     counter = 0 # counts the number of fails
@@ -166,22 +237,111 @@ def stumbledown_reducing(f, p, stepSize, nSteps):
         step = rand(2)*(2*newStepSize) - newStepSize
         q = p + step
         
-        if f(*q)<f(*p):
-            p = q
-            points[i] = [*p, f(*p), True]
+        fq = f(*q)
+        success = fq < fp
+        if success:
+            p, fp = q, fq
         else:
-            points[i] = [*p, f(*p), False]
             counter += 1
+        
+        if (success if acceptedOnly else i % every == 0):
+            if nRecorded == len(points): # double the space for the record
+                points = np.concatenate((points, np.empty_like(points)))
+                steps = np.concatenate((steps, np.empty_like(steps)))
+            
+            points[nRecorded] = [*p, fp, success]
+            steps[nRecorded] = i
+            nRecorded += 1
             
         if counter == nFails:
             multiplier += 1
             counter = 0 # reset the counter after reaching nfails
         i += 1 
-                
-    return points[:i]
+    
+    if not acceptedOnly and steps[nRecorded - 1] != i - 1: # the last step
+        points[nRecorded] = [*p, fp, success]
+        steps[nRecorded] = i - 1
+        nRecorded += 1
+    
+    if returnSteps:
+        return points[:nRecorded], steps[:nRecorded]
+    
+    return points[:nRecorded]
 
 
-def print_stumbledown_reducing(f, p, stepSize, nSteps):
+def stumbledown_population(f, p, stepSize, nSteps, nWalkers = 100):
+    
+    """
+    Implements the stumbledown reducing algorithm for many walkers at once. 
+    Every walker takes its own random step on each iteration, and f is 
+    evaluated for all of them in one call, so f must accept arrays of x and y
+    (as testf and gps_error do). Each walker reduces its own step size after
+    nFails failed steps.
+    
+    Parameters:
+        f (function): the function to be minimized
+        
+        p (array[float]): a 2 element array containing the initial (x, y) 
+        coordinates, around which the walkers start within one stepsize, or an
+        (nWalkers, 2) array of the starting point of each walker
+        
+        stepSize (float): maximum stepsize used to find the next position (x, y)
+        
+        nSteps (int): number of steps the algorithm will run through
+        
+        nWalkers (int): number of walkers, if p is a single point
+        
+    Returns:
+        points (array[float]): the best point found by any walker after each 
+        step, its function value, and whether it improved on that step, in 
+        the same layout as stumbledown_reducing
+        
+        walkers (array[float]): the final (x, y) point and function value of 
+        each walker
+    """
+    
+    p = np.array(p, dtype = float)
+    if p.ndim == 1:
+        p = p + rand(nWalkers, 2)*(2*stepSize) - stepSize
+    nWalkers = len(p)
+    
+    fp = f(p[:,0], p[:,1]) # value at each walker's current point
+    
+    factor = 0.5 # factor to decrease the step size by
+    tolerance = 10**(-8)
+    nFails = 5 # number of fails allowed before the step size is decreased
+    stepSizes = np.full(nWalkers, float(stepSize))
+    counters = np.zeros(nWalkers, dtype = int) # fails of each walker
+    
+    points = np.empty((nSteps, 4))
+    best = np.argmin(fp)
+    points[0] = [*p[best], fp[best], True]
+    
+    i = 1 # current step
+    while stepSizes.max() > tolerance and i < nSteps:
+        q = p + (rand(nWalkers, 2)*2 - 1)*stepSizes[:,None]
+        fq = f(q[:,0], q[:,1])
+        
+        better = fq < fp
+        p[better] = q[better]
+        fp[better] = fq[better]
+        
+        counters[~better] += 1
+        reduce = counters == nFails
+        stepSizes[reduce] *= factor
+        counters[reduce] = 0 # reset the counters after reaching nfails
+        
+        best = np.argmin(fp)
+        points[i] = [*p[best], fp[best], fp[best] < points[i - 1, 2]]
+        i += 1
+    
+    walkers = np.column_stack((p, fp))
+    
+    return points[:i], walkers
+
+
+def print_stumbledown_reducing(f, p, stepSize, nSteps, every = 1, 
+                               acceptedOnly = False):
     
     """
     Prints the results of the stumbledown algorithm. (Run in console)
@@ -196,33 +356,80 @@ def print_stumbledown_reducing(f, p, stepSize, nSteps):
         
         nSteps (int): number of steps the algorithm will run through
         
+        every, acceptedOnly: which steps to print, as in stumbledown_reducing
+        
     Returns:
         none
     """
     
-    print("{:8}{:12}{:11}{:10}{}".format("Steps","Success","x","y","f(x,y)"))
-    print("________________________________________________")
+    info, steps = stumbledown_reducing(f, p, stepSize, nSteps, every, 
+                                       acceptedOnly, returnSteps = True)
     
-    info = stumbledown_reducing(f, p, stepSize, nSteps)
+    print(format_stumbledown(info, steps))
+        
+
+@functools.lru_cache(maxsize = 8)
+def landscape(f, bounds = (0, 6, 0, 6), resolution = 100):
     
-    for i in range(nSteps):
-        if info[i, 3] == True:
-            success = 'Yes'
-        else:
-            success = '   '
-            
-        print("{:2}{:>11}{:11.3f}{:11.3f}{:13.3f}".format(i, success, 
-                                            info[i,0], info[i,1], info[i,2]))
+    """
+    Evaluates a function on a grid, once for each combination of function, 
+    bounds and resolution. The most recently used grids are kept, so that 
+    plotting more runs over the same function doesn't evaluate it again.
+    
+    Parameters:
+        f (function): the function, which must accept arrays of x and y
+        
+        bounds (tuple[float]): the (xMin, xMax, yMin, yMax) of the grid
         
+        resolution (int): number of points along each side of the grid
+        
+    Returns:
+        X, Y (array[float]): the x and y coordinates of the grid points
+        
+        Z (array[float]): the function value at each grid point
+    """
+    
+    xpts = np.linspace(bounds[0], bounds[1], resolution)
+    ypts = np.linspace(bounds[2], bounds[3], resolution)
+    
+    X, Y = np.meshgrid(xpts, ypts)
+    Z = f(X, Y)
+    
+    for grid in (X, Y, Z): # shared between calls, so mustn't be changed
+        grid.flags.writeable = False
+    
+    return X, Y, Z
 
-def plot_stumbledown(f, p, stepSize, nSteps):
+
+_contoured = weakref.WeakKeyDictionary() # the landscape drawn on each axes
+
+
+def _still_drawn(contours, ax):
+    
+    """
+    Checks whether the filled contours are still on the axes, as clearing the
+    axes removes them.
+    """
+    
+    # matplotlib before 3.8 draws the contours as one collection per level
+    if isinstance(contours, mpl.collections.Collection):
+        return contours in ax.collections
+    
+    return all(level in ax.collections for level in contours.collections)
+
+
+def plot_stumbledown(f, p, stepSize, nSteps, bounds = (0, 6, 0, 6), 
+                     resolution = 100):
     
     """
     Plots the steps taken by the Stumbledown Reducing algorithm and the 
-    level curves of the testf function. (Run in console)
+    level curves of the function f. The level curves are only drawn the first 
+    time a function is plotted on a set of axes, so further runs over the 
+    same function only add their steps. (Run in console)
     
     Parameters:
-        f (function): the function to be minimized
+        f (function): the function to be minimized, which must accept arrays 
+        of x and y
         
         p (array[float]): a 2 element array containing the initial (x, y) 
         coordinates
@@ -231,6 +438,10 @@ def plot_stumbledown(f, p, stepSize, nSteps):
         
         nSteps (int): number of steps the algorithm will run through
         
+        bounds (tuple[float]): the (xMin, xMax, yMin, yMax) of the level curves
+        
+        resolution (int): number of points along each side of the level curves
+        
     Returns:
         none
     """
@@ -241,16 +452,17 @@ def plot_stumbledown(f, p, stepSize, nSteps):
     x = location[:,0]
     y = location[:,1]
     
-    xpts = np.linspace(0, 6, 100)
-    ypts = np.linspace(0, 6, 100)
-    
-    X, Y = np.meshgrid(xpts, ypts)
-    Z = testf(X, Y)
-    
     plt.plot(x, y, color = 'black', linewidth = 2)
     plt.plot(x[-1], y[-1], color ='black', marker = '.', markersize = 2)
-    plt.contourf(X, Y, Z, cmap = 'BuPu')
-    plt.colorbar()
+    
+    ax = plt.gca()
+    key = (f, tuple(bounds), resolution)
+    drawnKey, contours = _contoured.get(ax, (None, None))
+    if drawnKey != key or not _still_drawn(contours, ax):
+        X, Y, Z = landscape(f, tuple(bounds), resolution)
+        contours = plt.contourf(X, Y, Z, cmap = 'BuPu')
+        plt.colorbar()
+        _contoured[ax] = (key, contours)
     
     plt.title('Contour Plot and Algorithm Steps', fontsize = 16, pad = 10)
     plt.xlabel('x', fontsize = 14, labelpad = 10)
@@ -258,44 +470,470 @@ def plot_stumbledown(f, p, stepSize, nSteps):
 
 
 # GPS Error Exercise
-def gps_error(x, y):
+def gps_error(x, y, satellite = SATELLITES):
     
     """
     Calculates the error for any (x, y) position based on the mismatch 
-    between the calculated and actual distances of each satellite.
+    between the calculated and actual distances of each satellite. x and y 
+    may be arrays of positions, in which case the error of every position is
+    calculated at once.
+    
+    Parameters:
+        x (float or array): the x coordinate(s)
+        
+        y (float or array): the y coordinate(s)
+        
+        satellite (array[float]): an (N, 3) array of the [x, y, d] of each 
+        satellite. Bind a different set once with functools.partial to pass 
+        it to the stumbledown functions.
+        
+    Returns:
+        mismatchError (float or array): the sum of the squared errors between
+        the calculated and actual distances of each satellite and the 
+        position (x, y), with the shape of x and y broadcast together
+    """
+    
+    x, y = np.broadcast_arrays(x, y)
+    
+    # one column per satellite
+    calculated = np.hypot(x[...,None] - satellite[:,0], 
+                          y[...,None] - satellite[:,1])
+    mismatch = (calculated - satellite[:,2])**2
+    
+    mismatchError = mismatch.sum(axis = -1)
+    
+    return mismatchError[()] if mismatchError.ndim == 0 else mismatchError
+
+
+def gps_residuals(x, y, satellite = SATELLITES):
+    
+    """
+    Calculates the mismatch between the calculated and actual distance of 
+    each satellite from the position (x, y), and the slope of each mismatch
+    with respect to x and y.
     
     Parameters:
         x (float): the x coordinate
         
         y (float): the y coordinate
         
+        satellite (array[float]): an (N, 3) array of the [x, y, d] of each 
+        satellite
+        
     Returns:
-        mismatchError (float): the sum of the errors between the calculated and
-        actual distances of each of the 5 satellites and the position (x, y)
+        mismatch (array[float]): the N mismatches, whose squares sum to 
+        gps_error(x, y)
+        
+        jacobian (array[float]): an (N, 2) array of the derivatives of each 
+        mismatch with respect to x and y
     """
     
-    satellite = np.array([[567, 390.7, 366.9], [73.2, 499.5, 444.9], 
-                          [204, 501, 386], [337.3, 609.3, 480.5], 
-                          [368.5, 116.3, 57.0]]) #[x,y,d]
+    dx = x - satellite[:,0]
+    dy = y - satellite[:,1]
+    calculated = np.hypot(dx, dy)
     
-    calculated1 = np.sqrt((x - satellite[0,0])**2 + (y - satellite[0,1])**2)
-    mismatch1 = (calculated1 - satellite[0,2])**2
+    mismatch = calculated - satellite[:,2]
+    jacobian = np.column_stack((dx, dy))/calculated[:,None]
     
-    calculated2 = np.sqrt((x - satellite[1,0])**2 + (y - satellite[1,1])**2)
-    mismatch2 = (calculated2 - satellite[1,2])**2
+    return mismatch, jacobian
+
+
+def levenberg_marquardt(f, p, nSteps = 100, damping = 10**(-3), 
+                        tolerance = 10**(-15)):
     
-    calculated3 = np.sqrt((x - satellite[2,0])**2 + (y - satellite[2,1])**2)
-    mismatch3 = (calculated3 - satellite[2,2])**2
+    """
+    Implements the Levenberg-Marquardt algorithm for minimizing a sum of 
+    squared residuals. Each step solves the linearized problem 
+    (J^T J + damping*diag(J^T J)) step = -J^T r. A successful step reduces the
+    damping tenfold, towards a pure Gauss-Newton step, and a failed one 
+    increases it tenfold, towards a short gradient descent step. With 
+    damping = 0 the steps are Gauss-Newton steps for as long as they succeed.
     
-    calculated4 = np.sqrt((x - satellite[3,0])**2 + (y - satellite[3,1])**2)
-    mismatch4 = (calculated4 - satellite[3,2])**2
+    Parameters:
+        f (function): returns the residuals and their (N, 2) Jacobian at a 
+        point (x, y), like gps_residuals
+        
+        p (array[float]): a 2 element array containing the initial (x, y) 
+        coordinates
+        
+        nSteps (int): the most steps the algorithm will run through
+        
+        damping (float): the initial damping
+        
+        tolerance (float): the algorithm stops once a step changes the 
+        position or the error by less than this fraction
+        
+    Returns:
+        points (array[float]): contains all of the (x, y) points, the sum of 
+        squared residuals at the points, and whether the new point was better
+        than the current point, in the same layout as stumbledown_reducing
+    """
     
-    calculated5 = np.sqrt((x - satellite[4,0])**2 + (y - satellite[4,1])**2)
-    mismatch5 = (calculated5 - satellite[4,2])**2
+    p = np.array(p, dtype = float)
+    residuals, jacobian = f(*p)
+    error = residuals @ residuals
     
-    mismatchError = np.sum([mismatch1, mismatch2, mismatch3, mismatch4, mismatch5])
+    points = np.empty((nSteps, 4))
+    points[0] = [*p, error, True]
     
-    return mismatchError
+    i = 1 # current step
+    while i < nSteps:
+        A = jacobian.T @ jacobian
+        gradient = jacobian.T @ residuals
+        step = np.linalg.solve(A + damping*np.diag(np.diag(A)), -gradient)
+        
+        q = p + step
+        newResiduals, newJacobian = f(*q)
+        newError = newResiduals @ newResiduals
+        
+        if newError < error:
+            converged = error - newError <= tolerance*error
+            p, residuals, jacobian, error = q, newResiduals, newJacobian, newError
+            damping /= 10
+            points[i] = [*p, error, True]
+        else:
+            converged = False
+            damping = max(10*damping, 10**(-3))
+            points[i] = [*p, error, False]
+        i += 1
+        
+        if converged or np.abs(step).max() <= tolerance*np.abs(p).max():
+            break
+    
+    return points[:i]
+
+
+def satellite_geometry(positions):
+    
+    """
+    Precalculates everything about a set of satellites that multilaterate 
+    needs, so that it can be shared by any number of receivers.
+    
+    Subtracting the average of the equations |x - s_i|^2 = d_i^2 from each 
+    one cancels the |x|^2 term and leaves the linear equations 
+    -2(s_i - s)·x = d_i^2 - <d^2> - (|s_i|^2 - <|s|^2>), whose least squares
+    solution is found with the pseudo-inverse of the left hand side.
+    
+    Parameters:
+        positions (array[float]): an (N, D) array of the position of each 
+        satellite, with D = 2 or 3
+        
+    Returns:
+        geometry (dict): the satellite positions ('positions'), their squared
+        lengths ('squares') and the pseudo-inverse of the linear equations 
+        ('inverse')
+    """
+    
+    positions = np.array(positions, dtype = float)
+    squares = np.sum(positions**2, axis = 1)
+    inverse = np.linalg.pinv(-2*(positions - positions.mean(axis = 0)))
+    
+    return {'positions': positions, 'squares': squares, 'inverse': inverse}
+
+
+def _batch_gauss_newton(model, X, nSteps, tolerance):
+    
+    """
+    Takes Gauss-Newton steps for many independent least squares problems at 
+    once. model(X, rows) returns the residuals and Jacobians of the problems 
+    numbered rows at the points X, as arrays of shape (len(rows), N) and 
+    (len(rows), N, D). Problems stop taking steps once they have converged.
+    """
+    
+    X = X.copy()
+    active = np.arange(len(X)) # problems that haven't converged
+    
+    for i in range(nSteps):
+        residuals, jacobian = model(X[active], active)
+        A = np.einsum('mni,mnj->mij', jacobian, jacobian)
+        gradient = np.einsum('mni,mn->mi', jacobian, residuals)
+        
+        try:
+            step = np.linalg.solve(A, -gradient[...,None])[...,0]
+        except np.linalg.LinAlgError: # some problem is degenerate
+            step = (np.linalg.pinv(A) @ -gradient[...,None])[...,0]
+        X[active] += step
+        
+        scale = np.maximum(1, np.abs(X[active]).max(axis = 1))
+        active = active[np.abs(step).max(axis = 1) > tolerance*scale]
+        if len(active) == 0:
+            break
+    
+    residuals, jacobian = model(X, np.arange(len(X)))
+    
+    return X, residuals, jacobian
+
+
+def _range_model(geometry, distances):
+    
+    """
+    Returns the function giving the mismatches between the calculated and 
+    measured distances of each satellite, and their Jacobians, for 
+    _batch_gauss_newton.
+    """
+    
+    positions = geometry['positions']
+    
+    def model(X, rows):
+        difference = X[:,None,:] - positions
+        calculated = np.sqrt(np.sum(difference**2, axis = 2))
+        
+        return calculated - distances[rows], difference/calculated[...,None]
+    
+    return model
+
+
+def multilaterate(distances, geometry = None, nSteps = 20, 
+                  tolerance = 10**(-12)):
+    
+    """
+    Finds the positions of many receivers at once from the distances each one
+    measures to the same satellites. A first guess for every receiver comes 
+    from the linearized equations of satellite_geometry, and is then refined 
+    by vectorized Gauss-Newton steps on the actual mismatches.
+    
+    Parameters:
+        distances (array[float]): an (M, N) array of the distance from each of
+        M receivers to each of the N satellites, or the N distances of one 
+        receiver
+        
+        geometry (dict): the satellites, from satellite_geometry. Defaults to
+        the satellites of the GPS exercise.
+        
+        nSteps (int): the most Gauss-Newton steps taken
+        
+        tolerance (float): the steps stop once they move every receiver by 
+        less than this fraction of its coordinates
+        
+    Returns:
+        X (array[float]): an (M, D) array of the position of each receiver
+        
+        residuals (array[float]): an (M, N) array of the mismatches between 
+        the calculated and measured distances at those positions
+    """
+    
+    if geometry is None:
+        geometry = satellite_geometry(SATELLITES[:,:2])
+    
+    distances = np.asarray(distances, dtype = float)
+    single = distances.ndim == 1
+    distances = np.atleast_2d(distances)
+    
+    squares = distances**2 - geometry['squares']
+    X = (squares - squares.mean(axis = 1, keepdims = True)) @ geometry['inverse'].T
+    
+    X, residuals, jacobian = _batch_gauss_newton(
+        _range_model(geometry, distances), X, nSteps, tolerance)
+    
+    if single:
+        return X[0], residuals[0]
+    
+    return X, residuals
+
+
+def pseudorange_error(x, y, z, bias, satellite):
+    
+    """
+    Calculates the error for any (x, y, z) position and clock bias based on 
+    the mismatch between the calculated and measured pseudoranges of each 
+    satellite. The arguments may be arrays, as in gps_error.
+    
+    Parameters:
+        x, y, z (float or array): the coordinate(s)
+        
+        bias (float or array): the receiver clock bias, as a distance
+        
+        satellite (array[float]): an (N, 4) array of the [x, y, z, pseudorange]
+        of each satellite
+        
+    Returns:
+        mismatchError (float or array): the sum of the squared errors between
+        the calculated and measured pseudoranges
+    """
+    
+    x, y, z, bias = np.broadcast_arrays(x, y, z, bias)
+    
+    calculated = np.sqrt((x[...,None] - satellite[:,0])**2 
+                         + (y[...,None] - satellite[:,1])**2 
+                         + (z[...,None] - satellite[:,2])**2) + bias[...,None]
+    mismatch = (calculated - satellite[:,3])**2
+    
+    mismatchError = mismatch.sum(axis = -1)
+    
+    return mismatchError[()] if mismatchError.ndim == 0 else mismatchError
+
+
+def _pseudorange_model(geometry, pseudoranges):
+    
+    """
+    Returns the function giving the mismatches between the calculated and 
+    measured pseudoranges of each satellite, and their Jacobians with 
+    respect to the position and clock bias, for _batch_gauss_newton.
+    """
+    
+    positions = geometry['positions']
+    
+    def model(X, rows):
+        difference = X[:,None,:-1] - positions
+        calculated = np.sqrt(np.sum(difference**2, axis = 2)) + X[:,None,-1]
+        
+        jacobian = np.empty(difference.shape[:2] + (X.shape[1],))
+        jacobian[...,:-1] = difference/(calculated - X[:,None,-1])[...,None]
+        jacobian[...,-1] = 1
+        
+        return calculated - pseudoranges[rows], jacobian
+    
+    return model
+
+
+def _bancroft(geometry, pseudoranges):
+    
+    """
+    Solves the pseudorange equations exactly (Bancroft's method) for each 
+    row of pseudoranges. With the Lorentz product <a, c> = a_x c_x + a_y c_y 
+    + a_z c_z - a_b c_b, the rows B_i = [s_i, pseudorange_i] and the unknown 
+    u = [x, y, z, b], the equations are <B_i, u> = <B_i, B_i>/2 + <u, u>/2, 
+    which are linear once <u, u>/2 is solved from a quadratic. Of the two 
+    solutions the one with the smaller error is kept, or if both fit equally
+    well (as with exactly 4 satellites), the one nearer the origin.
+    """
+    
+    nRows, N = pseudoranges.shape
+    B = np.empty((nRows, N, 4))
+    B[...,:3] = geometry['positions']
+    B[...,3] = -pseudoranges # so that B @ u gives the Lorentz products
+    
+    lorentz = lambda a, c: np.sum(a[...,:3]*c[...,:3], axis = -1) - a[...,3]*c[...,3]
+    
+    inverse = np.linalg.pinv(B)
+    p = inverse @ ((geometry['squares'] - pseudoranges**2)/2)[...,None]
+    q = inverse @ np.ones((nRows, N, 1))
+    p, q = p[...,0], q[...,0]
+    
+    # <q, q> L^2 + 2(<p, q> - 1) L + <p, p> = 0
+    a, b, c = lorentz(q, q), lorentz(p, q) - 1, lorentz(p, p)
+    root = np.sqrt(np.maximum(b**2 - a*c, 0))
+    
+    solutions = []
+    errors = []
+    for sign in (1, -1):
+        u = p + ((-b + sign*root)/a)[:,None]*q
+        calculated = np.sqrt(np.sum((u[:,None,:3] - geometry['positions'])**2, 
+                                    axis = 2)) + u[:,None,3]
+        solutions.append(u)
+        errors.append(np.sum((calculated - pseudoranges)**2, axis = 1))
+    
+    tolerance = 10**(-9)*np.sum(pseudoranges**2, axis = 1)
+    tie = np.abs(errors[0] - errors[1]) <= tolerance
+    nearer = (np.sum(solutions[1][:,:3]**2, axis = 1) 
+              < np.sum(solutions[0][:,:3]**2, axis = 1))
+    second = np.where(tie, nearer, errors[1] < errors[0])
+    
+    return np.where(second[:,None], solutions[1], solutions[0])
+
+
+def dilution_of_precision(jacobian):
+    
+    """
+    Calculates the dilution of precision from the Jacobians of the 
+    pseudorange fits, taking x and y as horizontal and z as vertical.
+    
+    Parameters:
+        jacobian (array[float]): an (M, N, 4) array of the Jacobian of each 
+        fit, as returned by solve_pseudoranges
+        
+    Returns:
+        dop (dict): arrays of the geometric ('GDOP'), position ('PDOP'), 
+        horizontal ('HDOP'), vertical ('VDOP') and time ('TDOP') dilution of 
+        precision of each fit
+    """
+    
+    Q = np.linalg.pinv(np.einsum('mni,mnj->mij', jacobian, jacobian))
+    variance = np.diagonal(Q, axis1 = 1, axis2 = 2)
+    
+    return {'GDOP': np.sqrt(variance.sum(axis = 1)), 
+            'PDOP': np.sqrt(variance[:,:3].sum(axis = 1)), 
+            'HDOP': np.sqrt(variance[:,:2].sum(axis = 1)), 
+            'VDOP': np.sqrt(variance[:,2]), 
+            'TDOP': np.sqrt(variance[:,3])}
+
+
+def solve_pseudoranges(pseudoranges, geometry, nSteps = 20, 
+                       tolerance = 10**(-12)):
+    
+    """
+    Finds the 3D positions and clock biases of many receivers, or of one 
+    receiver at many times, from the pseudoranges measured to the same 
+    satellites. The first guess for each receiver is the exact algebraic 
+    solution of Bancroft's method, then vectorized Gauss-Newton steps fit the
+    position and clock bias to the measurements by least squares.
+    
+    Parameters:
+        pseudoranges (array[float]): an (M, N) array of the pseudorange from 
+        each of M receivers to each of the N satellites, or the N 
+        pseudoranges of one receiver
+        
+        geometry (dict): the satellites, from satellite_geometry with 3D 
+        positions. At least 4 satellites are needed.
+        
+        nSteps (int): the most Gauss-Newton steps taken
+        
+        tolerance (float): the steps stop once they move every receiver by 
+        less than this fraction of its coordinates
+        
+    Returns:
+        X (array[float]): an (M, 4) array of the [x, y, z, bias] of each 
+        receiver
+        
+        residuals (array[float]): an (M, N) array of the mismatches between 
+        the calculated and measured pseudoranges
+        
+        dop (dict): the dilution of precision of each fit, from 
+        dilution_of_precision
+    """
+    
+    pseudoranges = np.asarray(pseudoranges, dtype = float)
+    single = pseudoranges.ndim == 1
+    pseudoranges = np.atleast_2d(pseudoranges)
+    
+    X = _bancroft(geometry, pseudoranges)
+    X, residuals, jacobian = _batch_gauss_newton(
+        _pseudorange_model(geometry, pseudoranges), X, nSteps, tolerance)
+    dop = dilution_of_precision(jacobian)
+    
+    if single:
+        return X[0], residuals[0], {key: value[0] for key, value in dop.items()}
+    
+    return X, residuals, dop
+
+
+def print_pseudorange(satellite, nSteps = 20):
+    
+    """
+    Solves for the position and clock bias of a receiver from the 
+    pseudoranges of the satellites, and prints them with the dilution of 
+    precision.
+    
+    Parameters:
+        satellite (array[float]): an (N, 4) array of the [x, y, z, pseudorange]
+        of each satellite, with N >= 4
+        
+        nSteps (int): the most Gauss-Newton steps taken
+        
+    Returns:
+        none
+    """
+    
+    geometry = satellite_geometry(satellite[:,:3])
+    X, residuals, dop = solve_pseudoranges(satellite[:,3], geometry, nSteps)
+    
+    print('Final x location:', X[0])
+    print('Final y location:', X[1])
+    print('Final z location:', X[2])
+    print('Clock bias:', X[3])
+    print('Error:', pseudorange_error(*X, satellite))
+    print(', '.join('{}: {:.2f}'.format(key, value) 
+                    for key, value in dop.items()))
 
 
 def print_gps(f, p, stepSize, nSteps):
@@ -331,22 +969,57 @@ def print_gps(f, p, stepSize, nSteps):
     plt.plot(x[-1], y[-1], color = 'black', marker = '.', markersize = 15)
 
 
-# Plot the satellite circles and final location
-satellite = np.array([[567, 390.7, 366.9], [73.2, 499.5, 444.9], [204, 501, 386], 
-                      [337.3, 609.3, 480.5], [368.5, 116.3, 57.0]]) #[x,y,d]
-startPoint = np.array([500, 500])
+if __name__ == '__main__':
+    # Plot the satellite circles and final location
+    startPoint = np.array([500, 500])
+
+    plt.figure(figsize = (10, 7))
+    ax = plt.gca()
+    print_gps(gps_error, startPoint, 400, 1000)
+    for sats in SATELLITES: # plots a circle of radius d around each satellite
+        circle = plt.Circle((sats[0], sats[1]), radius = sats[2], fc = 'none', 
+                            ec = 'turquoise')
+        ax.add_patch(circle)
+
+    plt.xlim([-400, 1000])
+    plt.ylim([0, 1200])
+
+    plt.title('Satellite Circles and the Final Location', fontsize = 16, pad = 10)
+    plt.xlabel('x', fontsize = 14, labelpad = 10)
+    plt.ylabel('y', fontsize = 14, labelpad = 10)
+    ax.tick_params(axis = 'both', labelsize = 12)
+
+
+    # Stumbledown With Many Walkers
+    """
+    NOTE: every walker searches from its own point near startPoint, and the best
+    point any of them has found is kept.
+    """
+    # points, walkers = stumbledown_population(gps_error, startPoint, 400, 1000)
+    # print('Best x location:', points[-1, 0])
+    # print('Best y location:', points[-1, 1])
+
 
-plt.figure(figsize = (10, 7))
-ax = plt.gca()
-print_gps(gps_error, startPoint, 400, 1000)
-for sats in satellite: # plots a circle of radius d around each satellite
-    circle = plt.Circle((sats[0], sats[1]), radius = sats[2], fc = 'none', ec = 'turquoise')
-    ax.add_patch(circle)
+    # Levenberg-Marquardt
+    """
+    NOTE: uses the slopes of the mismatches to reach the same minimum as 
+    print_gps in about 10 steps.
+    """
+    # points = levenberg_marquardt(gps_residuals, startPoint)
+    # print(format_stumbledown(points))
 
-plt.xlim([-400, 1000])
-plt.ylim([0, 1200])
 
-plt.title('Satellite Circles and the Final Location', fontsize = 16, pad = 10)
-plt.xlabel('x', fontsize = 14, labelpad = 10)
-plt.ylabel('y', fontsize = 14, labelpad = 10)
-ax.tick_params(axis = 'both', labelsize = 12)
\ No newline at end of file
+    # Many Receivers at Once
+    # X, residuals = multilaterate(SATELLITES[:,2])
+    # print('Final x, y location:', X)
+
+
+    # 3D Positioning With Clock Bias
+    """
+    NOTE: the satellites are [x, y, z, pseudorange] in km, for a receiver on 
+    the surface of the earth whose clock is off by about 10 km of travel time.
+    """
+    # print_pseudorange(np.array([[15600, 7540, 20140, 22177.1], 
+    #                             [18760, 2750, 18610, 22614.8], 
+    #                             [17610, 14630, 13480, 24023.8], 
+    #                             [19170, 610, 18390, 22680.8]]))
\ No newline at end of file